@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import desc
+from sqlalchemy import desc, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 import uuid
 from decimal import Decimal
+from typing import Literal, Optional
 
-from app.database import get_db
-from app.models import WalletTransaction, RewardHistory
+from app.database import get_db, SessionLocal
+from app.models import WalletTransaction, WalletBalance
+from app.points_utils import record_reward
 from app.schemas import WalletAddBalance, WalletBalanceOut, WalletHistoryOut, WalletTransactionOut
 from app.profile.user_auth import get_current_user_object, check_authorization_key
+from app.pagination_utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
 
 router = APIRouter(
     prefix="/wallet",
@@ -17,6 +22,43 @@ router = APIRouter(
 )
 
 
+def latest_balance_query(user_id: int):
+    return (
+        select(WalletTransaction)
+        .where(WalletTransaction.user_id == user_id)
+        .order_by(desc(WalletTransaction.created_at), desc(WalletTransaction.id))
+        .limit(1)
+    )
+
+
+async def lock_wallet_balance(db: AsyncSession, user_id: int) -> WalletBalance:
+    """
+    Return the user's balance row locked FOR UPDATE, creating it first if needed.
+    Wallets that predate the snapshot table are seeded from their latest transaction.
+    """
+    seed_balance = latest_balance_query(user_id).with_only_columns(WalletTransaction.current_balance).scalar_subquery()
+    seed_count = (
+        select(func.count()).select_from(WalletTransaction).where(WalletTransaction.user_id == user_id).scalar_subquery()
+    )
+    await db.execute(
+        insert(WalletBalance)
+        .values(
+            user_id=user_id,
+            balance=func.coalesce(seed_balance, 0),
+            transaction_count=seed_count,
+            updated_at=datetime.now(),
+        )
+        .on_conflict_do_nothing(index_elements=[WalletBalance.user_id])
+    )
+    result = await db.execute(
+        select(WalletBalance)
+        .where(WalletBalance.user_id == user_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
+
+
 @router.get("/balance", response_model=WalletBalanceOut)
 async def get_balance(
     current_user = Depends(get_current_user_object),
@@ -24,9 +66,16 @@ async def get_balance(
     _auth=Depends(check_authorization_key)
 ):
     user, profile = current_user
-    result = await db.execute(
-        select(WalletTransaction).where(WalletTransaction.user_id == user.id).order_by(desc(WalletTransaction.created_at)).limit(1)
-    )
+    snapshot = await db.get(WalletBalance, user.id)
+    if snapshot:
+        return WalletBalanceOut(
+            user_name = profile.first_name + profile.last_name,
+            balance=snapshot.balance,
+            last_updated=snapshot.updated_at
+        )
+
+    # No snapshot yet: wallet has not been topped up since the snapshot table was introduced
+    result = await db.execute(latest_balance_query(user.id))
     last_txn = result.scalars().first()
     balance = last_txn.current_balance if last_txn else Decimal("0.00")
     return WalletBalanceOut(
@@ -44,13 +93,9 @@ async def add_balance(
     _auth=Depends(check_authorization_key)
 ):
     user, _ = current_user
-    result = await db.execute(
-        select(WalletTransaction).where(WalletTransaction.user_id == user.id).order_by(desc(WalletTransaction.created_at)).limit(1)
-    )
-    last_txn = result.scalars().first()
-    prev_balance = last_txn.current_balance if last_txn else Decimal("0.00")
-
-    new_balance = prev_balance + payload.amount
+    # Row lock serializes concurrent top-ups for the same user until commit
+    wallet = await lock_wallet_balance(db, user.id)
+    new_balance = wallet.balance + payload.amount
     points = payload.amount * Decimal("10") / Decimal("100")  # earning 10 points per 100 currency
 
     txn = WalletTransaction(
@@ -63,28 +108,63 @@ async def add_balance(
         current_balance=new_balance
     )
     db.add(txn)
+    wallet.balance = new_balance
+    wallet.transaction_count = wallet.transaction_count + 1
+    wallet.updated_at = datetime.now()
     await db.flush()
-    reward = RewardHistory(
-        user_id=user.id,
-        action_type_id=10,
-        points=int(points),  # if you want to store only integer points
-        timestamp=datetime.now()
-    )
-    db.add(reward)    
+    await record_reward(db, user.id, action_type_id=10, points=int(points))  # points are stored as integers
     await db.commit()
     await db.refresh(txn)
     return txn
 
 
+def history_query(user_id: int):
+    return (
+        select(WalletTransaction)
+        .where(WalletTransaction.user_id == user_id)
+        .order_by(desc(WalletTransaction.created_at), desc(WalletTransaction.id))
+    )
+
+
+async def stream_history_ndjson(user_id: int):
+    """Yield every transaction as one JSON line, without materializing the full history."""
+    async with SessionLocal() as session:
+        rows = await session.stream_scalars(history_query(user_id).execution_options(yield_per=500))
+        async for txn in rows:
+            yield WalletTransactionOut.model_validate(txn).model_dump_json() + "\n"
+
+
 @router.get("/transaction_history", response_model=WalletHistoryOut)
 async def transaction_history(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Number of transactions per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    format: Literal["json", "ndjson"] = Query("json", description="ndjson streams the full history for export"),
     current_user = Depends(get_current_user_object),
     db: AsyncSession = Depends(get_db),
     _auth=Depends(check_authorization_key)
 ):
     user, _ = current_user
-    result = await db.execute(
-        select(WalletTransaction).where(WalletTransaction.user_id == user.id).order_by(desc(WalletTransaction.created_at))
-    )
+    if format == "ndjson":
+        return StreamingResponse(stream_history_ndjson(user.id), media_type="application/x-ndjson")
+
+    query = history_query(user.id)
+    if cursor:
+        last_created_at, last_id = decode_cursor(cursor, datetime.fromisoformat, int)
+        query = query.where(
+            tuple_(WalletTransaction.created_at, WalletTransaction.id) < tuple_(last_created_at, last_id)
+        )
+    result = await db.execute(query.limit(limit + 1))
     txns = result.scalars().all()
-    return WalletHistoryOut(transactions=txns, total=len(txns))
+    next_cursor = None
+    if len(txns) > limit:
+        txns = txns[:limit]
+        next_cursor = encode_cursor(txns[-1].created_at, txns[-1].id)
+
+    snapshot = await db.get(WalletBalance, user.id)
+    if snapshot:
+        total = snapshot.transaction_count
+    else:
+        total = (await db.execute(
+            select(func.count()).select_from(WalletTransaction).where(WalletTransaction.user_id == user.id)
+        )).scalar_one()
+    return WalletHistoryOut(transactions=txns, total=total, next_cursor=next_cursor)
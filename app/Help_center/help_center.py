@@ -1,11 +1,10 @@
-import asyncio
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from typing import List, Optional
 from app.database import get_db
 from app.models import (
-    IssueType, IssueOption, SupportTicket,
+    IssueOption, SupportTicket,
     ChatSupport, EmailSupport
 )
 from app.schemas import (
@@ -17,15 +16,12 @@ from app.schemas import (
 from app.profile.user_auth import (
     get_current_user_object, check_authorization_key, get_current_user
 )
-from app.email_utils import send_email
-from uuid import uuid4
+from app.email_utils import add_to_outbox, outbox_dispatcher
+from app.reference_data import reference_response
+from app.storage_utils import MEDIA_ROOT, UploadTooLarge, InfectedUpload, store_upload, retain_blob
 from pathlib import Path
-import shutil
 import json
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
 router = APIRouter(
     prefix="/help",
     tags=["Help Center"]
@@ -33,12 +29,11 @@ router = APIRouter(
 
 @router.get("/issue_type", response_model=List[IssueTypeOut])
 async def get_issue_types(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     _auth=Depends(check_authorization_key),
     _user=Depends(get_current_user)
 ):
-    result = await db.execute(select(IssueType))
-    return result.scalars().all()
+    return await reference_response(request, "issue_type")
 
 @router.get("/issue_option", response_model=List[IssueOptionOut])
 async def get_issue_options(
@@ -71,14 +66,16 @@ async def create_support_ticket(
     user, profile = current_user
     ticket_data["user_id"] = user.id
 
-    # Save file to disk and store path only
+    # Store file by content and keep its path only
     if image:
-        file_ext = Path(image.filename).suffix
-        filename = f"{uuid4().hex}{file_ext}"
-        file_path = UPLOAD_DIR / filename
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(image.file, f)  # safely copy bytes to file
-        ticket_data["image"] = str(file_path)  # only path is stored
+        try:
+            blob = await store_upload(image, Path(image.filename).suffix)
+        except UploadTooLarge:
+            raise HTTPException(status_code=400, detail="Image must be under 5MB.")
+        except InfectedUpload:
+            raise HTTPException(status_code=400, detail="Image failed virus scan.")
+        ticket_data["image"] = str(MEDIA_ROOT / blob.path)  # only path is stored
+        await retain_blob(db, blob.path)
 
     if ticket_data.get("assigned_to") is not None:
         ticket_data["assigned_to"] = str(ticket_data["assigned_to"])
@@ -160,8 +157,7 @@ async def create_email_support(
             status="pending"
         )
         db.add(new_email_support)
-        await db.commit()
-        await db.refresh(new_email_support)
+        await db.flush()
 
         confirmation_message = f"""
         Dear {profile.first_name},
@@ -180,16 +176,15 @@ async def create_email_support(
         MedoCRM Support Team
         """
 
-        try:
-            asyncio.create_task(
-                send_email(
-                    user.email,
-                    f"Support Request Received - ES-{new_email_support.id}",
-                    confirmation_message
-                )
-            )
-        except Exception as e:
-            print(f"Failed to send email: {e}")
+        add_to_outbox(
+            db,
+            user.email,
+            f"Support Request Received - ES-{new_email_support.id}",
+            confirmation_message
+        )
+        await db.commit()
+        await db.refresh(new_email_support)
+        outbox_dispatcher.wake()
 
         return new_email_support
 
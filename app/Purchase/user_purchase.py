@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.database import get_mongo_db
-from datetime import datetime
 from app.database import get_db
 from app.profile.user_auth import get_current_user_object, check_authorization_key
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import TopSellingCategory, ConcernList, CancelReason, BrandList
-from app.schemas import TopSellingCategoryOut, ConcernListOut, CancelReasonOut
+from app.reference_data import reference_response
+from app.medicine_utils import (
+    PUBLIC_PROJECTION, search_medicines, salt_filter, product_compounds, get_substitutes,
+)
+from app.search_history_utils import search_history_writer
 
 router = APIRouter(
     prefix="/purchase",
@@ -27,27 +29,10 @@ async def search_medicine(
     user_id = str(user.id)  # or profile.id depending on your schema
 
     collection = mongo_db["master_medicine"]
+    results = await search_medicines(collection, name, limit)
 
-    cursor = collection.find(
-        {"product_name": {"$regex": name, "$options": "i"}},
-        {"_id": 0}
-    ).limit(limit)
-    results = await cursor.to_list(length=limit)
-
-    # Save search in search_history collection
-    history_collection = mongo_db["search_history"]
-    await history_collection.update_one(
-        {"user_id": user_id},
-        {
-            "$push": {
-                "history": {
-                    "$each": [{"name": name, "searched_at": datetime.now()}],
-                    "$slice": -20  # keep only last 20 searches
-                }
-            }
-        },
-        upsert=True
-    )
+    # Logged in the background; flushed to search_history in batches
+    search_history_writer.record(user_id, name)
 
     return results
 
@@ -72,7 +57,7 @@ async def product_details(
     mongo_db: AsyncIOMotorDatabase = Depends(get_mongo_db)
 ):
     collection = mongo_db["master_medicine"]
-    product = await collection.find_one({"product_id": product_id}, {"_id": 0})
+    product = await collection.find_one({"product_id": product_id}, PUBLIC_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
@@ -96,11 +81,9 @@ async def medicine_list(
         filters["category"] = {"$regex": category, "$options": "i"}
 
     if salt:
-        filters["$or"] = [
-            {f"compound_{i}": {"$regex": salt, "$options": "i"}} for i in range(1, 25)
-        ]
+        filters.update(salt_filter(salt))
 
-    cursor = collection.find(filters, {"_id": 0}).limit(limit)
+    cursor = collection.find(filters, PUBLIC_PROJECTION).limit(limit)
     return await cursor.to_list(length=limit)
 
 # Similar Products (by salt)
@@ -115,76 +98,40 @@ async def similar_product(
     product = await collection.find_one({"product_name": product_name}, {"_id": 0})
     if not product:
         return {"error": "Product not found"}
-    
-    compounds = []
-    for i in range(1, 25):
-        comp = product.get(f"compound_{i}")
-        if comp:
-            compounds.append(comp)
-
-    if not compounds:
-        return {"error": "No salt composition available"}
-
-    # build OR filter for similar compounds
-    compound_filters = [
-        {f"compound_{i}": {"$in": compounds}} for i in range(1, 9)
-    ]
 
-    cursor = collection.find(
-        {
-            "product_name": {"$ne": product_name},
-            "$or": compound_filters
-        },
-        {"_id": 0}
-    ).limit(limit)
+    if not product_compounds(product):
+        return {"error": "No salt composition available"}
 
-    results = await cursor.to_list(length=limit)
-    return results
+    return await get_substitutes(collection, mongo_db["similar_products"], product, limit)
 
 @router.get("/concern_list")
 async def concern_list(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     current_user=Depends(get_current_user_object),
     _auth=Depends(check_authorization_key)
 ):
-    result = await db.execute(
-        ConcernList.__table__.select()
-    )
-    concerns = result.fetchall()
-    return [{"id": c.id, "category": c.category} for c in concerns]
+    return await reference_response(request, "concern_list")
 
 @router.get("/top_selling_category")
 async def top_selling_category(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     current_user=Depends(get_current_user_object),
     _auth=Depends(check_authorization_key)
 ):
-    result = await db.execute(
-        TopSellingCategory.__table__.select()
-    )
-    categories = result.fetchall()
-    return [{"id": c.id, "category": c.category} for c in categories]
+    return await reference_response(request, "top_selling_category")
 
 @router.get("/cancel_reason")       
 async def cancel_reason(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     current_user=Depends(get_current_user_object),
     _auth=Depends(check_authorization_key)
 ):
-    result = await db.execute(
-        CancelReason.__table__.select()
-    )
-    reasons = result.fetchall()
-    return [{"id": r.id, "reason": r.reason} for r in reasons]
+    return await reference_response(request, "cancel_reason")
 
 @router.get("/brand_list")
 async def brand_list(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     current_user=Depends(get_current_user_object),
     _auth=Depends(check_authorization_key)
 ):
-    result = await db.execute(
-        BrandList.__table__.select()
-    )
-    brands = result.fetchall()
-    return [{"id": b.id, "brand": b.brand} for b in brands]
+    return await reference_response(request, "brand_list")
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,11 +12,61 @@ ALGORITHM = os.getenv("ALGORITHM")
 
 # Database settings
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_SLOW_CHECKOUT_SECONDS = float(os.getenv("DB_POOL_SLOW_CHECKOUT_SECONDS", "0.5"))
+
+# Per-request DB stats in a Server-Timing response header (debugging aid)
+REQUEST_STATS_HEADER = os.getenv("REQUEST_STATS_HEADER", "false").lower() == "true"
+
+# Authenticated principal (User + UserProfile) cache
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
+
+# One-time codes (OTP_STORE_URL empty = in-process store; "redis://..." needs the redis package)
+OTP_STORE_URL = os.getenv("OTP_STORE_URL", "")
+OTP_LENGTH = int(os.getenv("OTP_LENGTH", "6"))
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_CONTACT_LIMIT = int(os.getenv("OTP_CONTACT_LIMIT", "5"))
+OTP_IP_LIMIT = int(os.getenv("OTP_IP_LIMIT", "30"))
+OTP_RATE_WINDOW_SECONDS = int(os.getenv("OTP_RATE_WINDOW_SECONDS", "900"))
+# Proxies whose X-Forwarded-For is trusted for the client address (comma-separated IPs/CIDRs, or "*").
+# The per-IP OTP limit keys on it, so list the load balancer here; same as uvicorn --forwarded-allow-ips.
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Reference-data (lookup table) cache
+REFERENCE_DATA_TTL_SECONDS = float(os.getenv("REFERENCE_DATA_TTL_SECONDS", "300"))
+REFERENCE_DATA_CLIENT_MAX_AGE = int(os.getenv("REFERENCE_DATA_CLIENT_MAX_AGE", "60"))
 
 # Mongo DB
 MONGO_DATABASE_HOST = os.getenv("MONGO_DATABASE_HOST")
 MONGO_DATABASE_NAME = os.getenv("MONGO_DATABASE_NAME")
 
+# Precomputed medicine substitutes (0 disables the periodic rebuild)
+SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS = float(os.getenv("SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS", "86400"))
+
+# Search history buffering
+SEARCH_HISTORY_BATCH_SIZE = int(os.getenv("SEARCH_HISTORY_BATCH_SIZE", "500"))
+SEARCH_HISTORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("SEARCH_HISTORY_FLUSH_INTERVAL_SECONDS", "1"))
+
+# Upload I/O
+MEDIA_ROOT = Path(os.getenv("MEDIA_ROOT", "app/uploads"))  # blob store for uploads
+UPLOAD_IO_WORKERS = int(os.getenv("UPLOAD_IO_WORKERS", "4"))
+IMAGE_PROCESSING_WORKERS = int(os.getenv("IMAGE_PROCESSING_WORKERS", "2"))
+
+# Virus scanning (clamd)
+VIRUS_SCAN_ENABLED = os.getenv("VIRUS_SCAN_ENABLED", "false").lower() == "true"
+CLAMD_HOST = os.getenv("CLAMD_HOST", "127.0.0.1")
+CLAMD_PORT = int(os.getenv("CLAMD_PORT", "3310"))
+CLAMD_POOL_SIZE = int(os.getenv("CLAMD_POOL_SIZE", "4"))
+CLAMD_TIMEOUT_SECONDS = float(os.getenv("CLAMD_TIMEOUT_SECONDS", "30"))
+VIRUS_SCAN_CACHE_TTL_SECONDS = int(os.getenv("VIRUS_SCAN_CACHE_TTL_SECONDS", "86400"))
+VIRUS_SCAN_SWEEP_INTERVAL_SECONDS = float(os.getenv("VIRUS_SCAN_SWEEP_INTERVAL_SECONDS", "60"))
+
 # Email settings
 EMAIL_ENABLED = os.getenv("EMAIL_ENABLED", "false").lower() == "true"
 
@@ -25,6 +76,17 @@ SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SMTP_FROM = os.getenv("SMTP_FROM")
 EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() == "true"
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "1000"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", "20"))
+SMTP_IDLE_TIMEOUT_SECONDS = float(os.getenv("SMTP_IDLE_TIMEOUT_SECONDS", "60"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "300"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+EMAIL_OUTBOX_RETRY_BACKOFF_SECONDS = int(os.getenv("EMAIL_OUTBOX_RETRY_BACKOFF_SECONDS", "30"))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
 
 
 COMPANY=os.getenv("COMPANY")
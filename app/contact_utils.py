@@ -0,0 +1,108 @@
+import asyncio
+import re
+from typing import List, NamedTuple, Optional
+from sqlalchemy import and_, func, or_, select, update
+from app.database import SessionLocal
+from app.models import User
+
+DEFAULT_COUNTRY_CODE = "+91"
+NATIONAL_NUMBER_LENGTH = 10  # Indian mobile numbers
+BACKFILL_BATCH_SIZE = 1000
+
+EMAIL_RE = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+PHONE_SEPARATORS_RE = re.compile(r"[\s().-]+")
+PHONE_RE = re.compile(r"(\+|00)?(\d{6,15})")
+
+
+class Contact(NamedTuple):
+    kind: str  # "email" or "phone"
+    value: str  # lowercased email, or E.164 phone such as "+919876543210"
+
+    @property
+    def is_email(self) -> bool:
+        return self.kind == "email"
+
+
+def normalize_phone(raw: str, country_code: Optional[str] = None) -> Optional[str]:
+    """E.164 form of a phone number; national numbers get `country_code` (default +91). None if invalid."""
+    match = PHONE_RE.fullmatch(PHONE_SEPARATORS_RE.sub("", raw))
+    if match is None:
+        return None
+    international, digits = match.groups()
+    if international:
+        # country codes never start with 0
+        return "+" + digits if len(digits) >= 8 and not digits.startswith("0") else None
+    if len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith("0"):  # trunk prefix
+        digits = digits[1:]
+    prefix = (country_code or DEFAULT_COUNTRY_CODE).lstrip("+")
+    if len(digits) == NATIONAL_NUMBER_LENGTH + len(prefix) and digits.startswith(prefix):
+        return "+" + digits
+    if len(digits) == NATIONAL_NUMBER_LENGTH:
+        return f"+{prefix}{digits}"
+    return None
+
+
+def classify_contact(raw: str) -> Optional[Contact]:
+    """Tell an email from a phone number and normalize it. None if it is neither."""
+    contact = raw.strip()
+    if "@" in contact:
+        return Contact("email", contact.lower()) if EMAIL_RE.fullmatch(contact) else None
+    phone = normalize_phone(contact)
+    return Contact("phone", phone) if phone else None
+
+
+def legacy_phone_forms(phone: str, country_code: Optional[str] = None) -> List[str]:
+    """Ways an E.164 number may have been typed into registration_user.phone_number."""
+    forms = [phone, phone.lstrip("+")]
+    prefix = country_code or DEFAULT_COUNTRY_CODE
+    if phone.startswith(prefix):
+        national = phone[len(prefix):]
+        forms += [national, "0" + national]
+    return forms
+
+
+def user_contact_filter(contact: Contact):
+    """
+    WHERE clause for the user owning `contact`, on the indexed lower(email) or phone_e164.
+    Until the phone_e164 backfill has reached a row it is matched on its raw phone_number.
+    """
+    if contact.is_email:
+        return func.lower(User.email) == contact.value
+    return or_(
+        User.phone_e164 == contact.value,
+        and_(User.phone_e164.is_(None), User.phone_number.in_(legacy_phone_forms(contact.value))),
+    )
+
+
+# ----------------------------
+# Backfill
+# ----------------------------
+async def backfill_phone_e164(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Fill registration_user.phone_e164 for rows written before the column existed."""
+    updated = 0
+    last_id = 0
+    while True:
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(User.id, User.phone_number, User.phone_country_code)
+                .where(User.id > last_id, User.phone_e164.is_(None), User.phone_number.is_not(None))
+                .order_by(User.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                return updated
+            for user_id, phone_number, country_code in rows:
+                phone = normalize_phone(phone_number, country_code)
+                if phone:
+                    await db.execute(update(User).where(User.id == user_id).values(phone_e164=phone))
+                    updated += 1
+                else:
+                    print(f"User {user_id}: cannot normalize phone number {phone_number!r}")
+            await db.commit()
+            last_id = rows[-1].id
+
+
+if __name__ == "__main__":
+    # One-off job after adding the column: python -m app.contact_utils
+    count = asyncio.run(backfill_phone_e164())
+    print(f"Backfilled phone_e164 for {count} users")
@@ -1,24 +1,48 @@
-from .config import DATABASE_URL
+from .config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+)
+from .pool_metrics import InstrumentedPool, instrument_engine
+from .request_metrics import MongoCommandListener, instrument_sqlalchemy
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from .config import MONGO_DATABASE_HOST, MONGO_DATABASE_NAME
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+instrument_engine(engine)
+instrument_sqlalchemy(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 Base = declarative_base()
 
+# Postgres deadlock_detected / serialization_failure: safe to retry the whole transaction
+RETRYABLE_SQLSTATES = {"40P01", "40001"}
+
+def is_retryable_error(error: Exception) -> bool:
+    orig = getattr(error, "orig", None)
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
 # Dependency to get the DB session
 async def get_db():
     async with SessionLocal() as session:
         yield session
 
-mongo_client = AsyncIOMotorClient(MONGO_DATABASE_HOST)
+mongo_client = AsyncIOMotorClient(MONGO_DATABASE_HOST, event_listeners=[MongoCommandListener()])
 mongo_db: AsyncIOMotorDatabase = mongo_client[MONGO_DATABASE_NAME]
 
 master_medicine_collection = mongo_db["master_medicine"]
 wishlist_collection = mongo_db["wishlist"]
+similar_products_collection = mongo_db["similar_products"]
+job_leases_collection = mongo_db["job_leases"]  # which worker runs a periodic job
 
 # Dependency for MongoDB
 async def get_mongo_db() -> AsyncIOMotorDatabase:
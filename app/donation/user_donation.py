@@ -1,17 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Form, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Form, UploadFile, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
-from sqlalchemy import select, and_, join
+from sqlalchemy import select, and_, join, tuple_, update, func
+from sqlalchemy.exc import DBAPIError
 from typing import List, Optional
 from datetime import datetime, date
-from app.database import get_db
+from app.database import get_db, is_retryable_error
 from decimal import Decimal
+import asyncio
+import random
 import uuid
 from app.file_utils import validate_and_save_file
-from app.models import Donation, NGOPost, NGOProfile, ContactPerson, PointsActionType, RewardHistory, User, PostType
+from app.storage_utils import retain_blob
+from app.models import (
+    Donation, NGOPost, NGOProfile, ContactPerson, PointsActionType, User, PostType,
+    CountryOption, StateOption, CityOption, AgeOption, GenderOption, SpendingPowerOption,
+)
 from app.schemas import DonationOut, PostTypeOut, DonationBillOut, NGOPostResponse
+from app.pagination_utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
 from app.profile.user_auth import get_current_user_object, check_authorization_key
+from app.reference_data import reference_response
+from app.points_utils import record_reward
 from app.config import COMPANY, GSTIN, ADDRESS, CONTACT, EMAIL
 
 router = APIRouter( 
@@ -19,6 +29,11 @@ router = APIRouter(
     tags=["donation"]
 )
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+DONATION_MAX_ATTEMPTS = 5
+DONATION_RETRY_BACKOFF_SECONDS = 0.05
+
 def convert_amount_to_words(amount: float) -> str:
     """Convert numeric amount into words (Indian numbering system)."""
     try:
@@ -76,17 +91,43 @@ def convert_amount_to_words(amount: float) -> str:
  # =========== Donation APIs ===========
 @router.get("/posts", response_model=list[NGOPostResponse])
 async def get_active_donation_posts(
+    response: Response,
     ngo_name: Optional[str] = Query(None, description="Filter by NGO name"),
     post_type_name: Optional[str] = Query(None, description="Filter by Post Type name"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Number of posts per page"),
+    cursor: Optional[str] = Query(None, description=f"{NEXT_CURSOR_HEADER} header of the previous page"),
     db: AsyncSession = Depends(get_db)
 ):
-    # Start with NGOPost
-    query = select(NGOPost, NGOProfile, PostType).join(
+    # Lookup names are resolved in the same statement, so the query count
+    # stays constant regardless of how many posts are returned.
+    query = select(
+        NGOPost,
+        NGOProfile,
+        PostType.name.label("post_type"),
+        CountryOption.name.label("country"),
+        StateOption.name.label("state"),
+        CityOption.name.label("city"),
+        AgeOption.name.label("age_group"),
+        GenderOption.name.label("gender"),
+        SpendingPowerOption.name.label("spending_power"),
+    ).join(
         User, NGOPost.user_id == User.id
     ).join(
         NGOProfile, NGOProfile.user_id == User.id
     ).join(
         PostType, NGOPost.post_type_id == PostType.id
+    ).outerjoin(
+        CountryOption, NGOPost.country_id == CountryOption.id
+    ).outerjoin(
+        StateOption, NGOPost.state_id == StateOption.id
+    ).outerjoin(
+        CityOption, NGOPost.city_id == CityOption.id
+    ).outerjoin(
+        AgeOption, NGOPost.age_group_id == AgeOption.id
+    ).outerjoin(
+        GenderOption, NGOPost.gender_id == GenderOption.id
+    ).outerjoin(
+        SpendingPowerOption, NGOPost.spending_power_id == SpendingPowerOption.id
     )
 
     # Filters
@@ -100,35 +141,37 @@ async def get_active_donation_posts(
         NGOPost.end_date >= date.today()
     )
 
-    result = await db.execute(query)
-    rows = result.all()  # Each row = (NGOPost, NGOProfile, PostType)
+    # Keyset pagination on (end_date, id): campaigns ending soonest come first
+    if cursor:
+        last_end_date, last_id = decode_cursor(cursor, date.fromisoformat, int)
+        query = query.where(tuple_(NGOPost.end_date, NGOPost.id) > tuple_(last_end_date, last_id))
+    query = query.order_by(NGOPost.end_date.asc(), NGOPost.id.asc()).limit(limit + 1)
 
-    response = []
-    for post_row, ngo, post_type in rows:
-        response.append(NGOPostResponse(
+    result = await db.execute(query)
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    posts = []
+    for row in rows:
+        post_row, ngo = row.NGOPost, row.NGOProfile
+        posts.append(NGOPostResponse(
             id=post_row.id,
             user_id=post_row.user_id,
             header=post_row.header,
             description=post_row.description,
             tags=post_row.tags,
-            post_type=post_type.name,  # <-- return name instead of id
+            post_type=row.post_type,  # <-- return name instead of id
             donation_frequency=post_row.donation_frequency,
             target_donation=post_row.target_donation,
             donation_received=post_row.donation_received,
-            # Country/State/City lookups if needed
-            country=(await db.get(NGOPost.country.property.mapper.class_, post_row.country_id)).name
-                    if post_row.country_id else None,
-            state=(await db.get(NGOPost.state.property.mapper.class_, post_row.state_id)).name
-                    if post_row.state_id else None,
-            city=(await db.get(NGOPost.city.property.mapper.class_, post_row.city_id)).name
-                    if post_row.city_id else None,
+            country=row.country,
+            state=row.state,
+            city=row.city,
             pincode=post_row.pincode,
-            age_group=(await db.get(NGOPost.age_group.property.mapper.class_, post_row.age_group_id)).name
-                      if post_row.age_group_id else None,
-            gender=(await db.get(NGOPost.gender.property.mapper.class_, post_row.gender_id)).name
-                      if post_row.gender_id else None,
-            spending_power=(await db.get(NGOPost.spending_power.property.mapper.class_, post_row.spending_power_id)).name
-                             if post_row.spending_power_id else None,
+            age_group=row.age_group,
+            gender=row.gender,
+            spending_power=row.spending_power,
             start_date=post_row.start_date,
             end_date=post_row.end_date,
             status=post_row.status,
@@ -147,20 +190,21 @@ async def get_active_donation_posts(
             ngo_address=ngo.address,
         ))
 
-    return response
+    # The body stays a plain list for existing clients; the cursor travels in a header
+    if has_more:
+        last_post = rows[-1].NGOPost
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_post.end_date, last_post.id)
+    return posts
 
 
 @router.get("/post_types", response_model=List[PostTypeOut])
 async def get_post_types(
-    db: AsyncSession = Depends(get_db), 
+    request: Request,
     _auth=Depends(check_authorization_key),
     current_user = Depends(get_current_user_object)
 ):
     try:
-        query = select(PostType).where(PostType.is_active == True)
-        result = await db.execute(query)
-        post_types = result.scalars().all()
-        return post_types
+        return await reference_response(request, "post_types")
     except Exception as e:
         print(f"Error getting post types: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get post types: {str(e)}")
@@ -176,6 +220,8 @@ async def donate_pay(
     current_user=Depends(get_current_user_object)
 ):
     user, _ = current_user
+    user_id = user.id  # rollbacks below expire ORM instances
+    amount = Decimal(str(donation_amount))
 
     # Fetch post
     post_query = select(NGOPost).where(NGOPost.id == post_id)
@@ -189,30 +235,36 @@ async def donate_pay(
     if donation_amount < 100:
         raise HTTPException(status_code=400, detail="Minimum donation is ₹100")
 
-    # Target limit check
-    donation_received = Decimal(post.donation_received or 0)
-    if donation_received + Decimal(str(donation_amount)) > post.target_donation:
+    # Early target check; the conditional update below is the authoritative one
+    if Decimal(post.donation_received or 0) + amount > post.target_donation:
         raise HTTPException(status_code=400, detail="Donation exceeds target amount")
 
-    # Frequency check
-    freq = (post.donation_frequency or "once").lower()
-    user_donations_query = select(Donation).where(and_(Donation.ngopost_id == post.id, Donation.user_id == user.id))
-    user_donations = (await db.execute(user_donations_query)).scalars().all()
-
-    allowed = 1 if "one" in freq else 2 if "two" in freq else 3 if "three" in freq else 1
-    if len(user_donations) >= allowed:
+    # Early frequency check; repeated under the row lock below
+    allowed = int(post.donations_allowed)
+    user_donations_query = select(func.count()).select_from(Donation).where(
+        and_(Donation.ngopost_id == post.id, Donation.user_id == user_id)
+    )
+    if (await db.execute(user_donations_query)).scalar() >= allowed:
         raise HTTPException(status_code=400, detail=f"You can donate only {allowed} time(s) to this post.")
 
     # PAN validation
     if not pan_number or len(pan_number) != 10:
         raise HTTPException(status_code=400, detail="Invalid PAN number")
 
-    # Save PAN document
-    pan_document_path, error = validate_and_save_file(
-        pan_document, "donation_docs", "PAN Document", user_type="common"
-    )
+    # Reward action lookup
+    action_type = None
+    try:
+        action_type_query = select(PointsActionType).where(PointsActionType.action_type == "Donate")
+        action_type = (await db.execute(action_type_query)).scalars().first()
+    except Exception as e:
+        print("PointsActionType missing:", e)
+    reward = (action_type.id, action_type.default_points) if action_type else None
+
+    # Save PAN document before opening the write transaction
+    pan_document_path, error = await validate_and_save_file(pan_document, "PAN Document")
     if error:
         raise HTTPException(status_code=400, detail=error)
+    await db.rollback()  # end the read transaction so the write below is short
 
     # Calculate charges
     platform_fee = round(donation_amount * 0.02, 2)
@@ -223,45 +275,58 @@ async def donate_pay(
     order_id = uuid.uuid4().hex[:8]
     transaction_id = uuid.uuid4().hex[:8]
 
-    # Create donation record
-    donation = Donation(
-        ngopost_id=post.id,
-        user_id=user.id,
-        amount=donation_amount,
-        payment_method="UPI",
-        pan_number=pan_number,
-        pan_document=pan_document_path,
-        payment_status="Success",
-        order_id=order_id,
-        payment_date=datetime.utcnow(),
-        gst=gst,
-        platform_fee=platform_fee,
-        amount_to_ngo=amount_to_ngo,
-        transaction_id=transaction_id,
-    )
-    db.add(donation)
-
-    # Update post donation total
-    post.donation_received = float(donation_received + Decimal(str(donation_amount)))
-    db.add(post)
-
-    # Add reward points (if available)
-    try:
-        action_type_query = select(PointsActionType).where(PointsActionType.action_type == "Donate")
-        action_type = (await db.execute(action_type_query)).scalars().first()
-        if action_type:
-            points_entry = RewardHistory(
-                user_id=user.id,
-                action_type_id=action_type.id,
-                points=action_type.default_points,
-                timestamp=datetime.utcnow()
+    for attempt in range(DONATION_MAX_ATTEMPTS):
+        try:
+            # Atomically add to the total only while it stays within target
+            accepted = await db.execute(
+                update(NGOPost)
+                .where(
+                    NGOPost.id == post_id,
+                    func.coalesce(NGOPost.donation_received, 0) + amount <= NGOPost.target_donation,
+                )
+                .values(donation_received=func.coalesce(NGOPost.donation_received, 0) + amount)
+                .returning(NGOPost.donation_received)
             )
-            db.add(points_entry)
-    except Exception as e:
-        print("PointsActionType missing:", e)
-
-    # Commit all
-    await db.commit()
+            if accepted.first() is None:
+                await db.rollback()
+                raise HTTPException(status_code=400, detail="Donation exceeds target amount")
+
+            # The update holds the post's row lock until commit, so concurrent donations
+            # to this post are serialized and this count sees every committed one
+            if (await db.execute(user_donations_query)).scalar() >= allowed:
+                await db.rollback()
+                raise HTTPException(status_code=400, detail=f"You can donate only {allowed} time(s) to this post.")
+
+            # Create donation record
+            db.add(Donation(
+                ngopost_id=post_id,
+                user_id=user_id,
+                amount=donation_amount,
+                payment_method="UPI",
+                pan_number=pan_number,
+                pan_document=pan_document_path,
+                payment_status="Success",
+                order_id=order_id,
+                payment_date=datetime.utcnow(),
+                gst=gst,
+                platform_fee=platform_fee,
+                amount_to_ngo=amount_to_ngo,
+                transaction_id=transaction_id,
+            ))
+
+            # Add reward points (if available)
+            if reward:
+                await record_reward(db, user_id, reward[0], reward[1], timestamp=datetime.utcnow())
+            await retain_blob(db, pan_document_path)
+
+            # Commit all
+            await db.commit()
+            break
+        except DBAPIError as e:
+            await db.rollback()
+            if not is_retryable_error(e) or attempt == DONATION_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(DONATION_RETRY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
 
     return {
         "success": True,
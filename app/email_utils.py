@@ -1,5 +1,12 @@
+import asyncio
 import aiosmtplib
+from datetime import datetime, timedelta
 from email.message import EmailMessage
+from typing import List, Optional
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import SessionLocal
+from .models import EmailOutbox
 from .config import (
     SMTP_FROM,
     SMTP_HOST,
@@ -7,32 +14,395 @@ from .config import (
     SMTP_PORT,
     SMTP_USERNAME,
     EMAIL_USE_TLS,
+    EMAIL_QUEUE_SIZE,
+    SMTP_POOL_SIZE,
+    SMTP_BATCH_SIZE,
+    SMTP_IDLE_TIMEOUT_SECONDS,
+    SMTP_TIMEOUT_SECONDS,
+    EMAIL_OUTBOX_BATCH_SIZE,
+    EMAIL_OUTBOX_POLL_SECONDS,
+    EMAIL_OUTBOX_LEASE_SECONDS,
+    EMAIL_OUTBOX_MAX_ATTEMPTS,
+    EMAIL_OUTBOX_RETRY_BACKOFF_SECONDS,
+    EMAIL_OUTBOX_RETENTION_DAYS,
 )
 
+MAX_SEND_ATTEMPTS = 3
+RECONNECT_BACKOFF_SECONDS = 1.0
 
-async def send_email(recipient: str, subject: str, body: str):
-    print(f"📧 Attempting to send email to: {recipient}")
-    print(f"📧 Subject: {subject}")
-    print(f"📧 Body: {body}")
-    
+# Errors after which the connection is unusable; anything else is specific to one message
+CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError, asyncio.TimeoutError)
+
+
+def build_message(recipient: str, subject: str, body: str) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = SMTP_FROM
     msg["To"] = recipient
     msg["Subject"] = subject
     msg.set_content(body)
-    
-    print(f"🔗 Connecting to {SMTP_HOST}:{SMTP_PORT} with STARTTLS")
-    try:
-        await aiosmtplib.send(
-            msg,
+    return msg
+
+
+class OutboundEmail:
+    __slots__ = ("message", "result", "attempts", "error")
+
+    def __init__(self, message: EmailMessage, result: Optional[asyncio.Future]):
+        self.message = message
+        self.result = result
+        self.attempts = 0
+        self.error: Optional[str] = None
+
+    def settle(self, sent: bool) -> None:
+        if self.result is not None and not self.result.done():
+            self.result.set_result(sent)
+
+
+class MailStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.connects = 0
+
+
+# ----------------------------
+# Pooled SMTP sender
+# ----------------------------
+class MailQueue:
+    """
+    Bounded queue of outbound mail drained by `workers` long-lived SMTP sessions.
+    Each worker keeps one authenticated connection open, sends up to `batch_size`
+    queued messages per wakeup over it, reconnects when the server drops it, and
+    closes it after `idle_timeout` seconds without mail.
+    """
+
+    def __init__(self, max_size: int, workers: int, batch_size: int, idle_timeout: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.stats = MailStats()
+        self._queue: "asyncio.Queue[OutboundEmail]" = asyncio.Queue(maxsize=max_size)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def enqueue(self, recipient: str, subject: str, body: str) -> bool:
+        """Queue a message without waiting. Returns False (and counts a drop) when the queue is full."""
+        try:
+            self._queue.put_nowait(OutboundEmail(build_message(recipient, subject, body), None))
+            return True
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            print(f"Mail queue full ({self._queue.maxsize}); dropped message to {recipient}")
+            return False
+
+    async def submit(self, recipient: str, subject: str, body: str) -> OutboundEmail:
+        """Queue a message, waiting for room if needed; await `.result` for the outcome."""
+        outbound = OutboundEmail(build_message(recipient, subject, body), asyncio.get_running_loop().create_future())
+        await self._queue.put(outbound)
+        return outbound
+
+    async def send(self, recipient: str, subject: str, body: str) -> bool:
+        """Queue a message and wait until it is delivered or given up on."""
+        outbound = await self.submit(recipient, subject, body)
+        return await outbound.result
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
             hostname=SMTP_HOST,
             port=SMTP_PORT,
             username=SMTP_USERNAME,
             password=SMTP_PASSWORD,
             use_tls=False,
-            start_tls=True,
+            start_tls=EMAIL_USE_TLS,
+            timeout=SMTP_TIMEOUT_SECONDS,
+        )
+        await smtp.connect()
+        self.stats.connects += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: Optional[aiosmtplib.SMTP]) -> None:
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _deliver(self, smtp: Optional[aiosmtplib.SMTP], outbound: OutboundEmail) -> Optional[aiosmtplib.SMTP]:
+        """Send one message, reconnecting as needed; returns the connection to keep using."""
+        while True:
+            outbound.attempts += 1
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+                await smtp.send_message(outbound.message)
+                self.stats.sent += 1
+                outbound.settle(True)
+                return smtp
+            except CONNECTION_ERRORS as e:
+                await self._close(smtp)
+                smtp = None
+                if outbound.attempts >= MAX_SEND_ATTEMPTS:
+                    error = e
+                    break
+                await asyncio.sleep(RECONNECT_BACKOFF_SECONDS * outbound.attempts)
+            except Exception as e:
+                error = e
+                break
+        self.stats.failed += 1
+        outbound.error = f"{type(error).__name__}: {error}"
+        print(f"Email to {outbound.message['To']} failed after {outbound.attempts} attempt(s): {type(error).__name__}: {error}")
+        outbound.settle(False)
+        return smtp
+
+    async def _worker(self) -> None:
+        smtp: Optional[aiosmtplib.SMTP] = None
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self._close(smtp)
+                    smtp = None
+                    continue
+                batch = [first]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                for outbound in batch:
+                    try:
+                        smtp = await self._deliver(smtp, outbound)
+                    finally:
+                        self._queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Give queued mail `timeout` seconds to go out, then shut the workers down."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Mail queue stopped with {self.depth} message(s) unsent")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def render_prometheus(self) -> str:
+        return "\n".join([
+            "# HELP email_queue_depth Messages waiting for an SMTP worker.",
+            "# TYPE email_queue_depth gauge",
+            f"email_queue_depth {self.depth}",
+            "# HELP email_sent_total Messages accepted by the SMTP server.",
+            "# TYPE email_sent_total counter",
+            f"email_sent_total {self.stats.sent}",
+            "# HELP email_failed_total Messages given up on after retries.",
+            "# TYPE email_failed_total counter",
+            f"email_failed_total {self.stats.failed}",
+            "# HELP email_dropped_total Messages rejected because the queue was full.",
+            "# TYPE email_dropped_total counter",
+            f"email_dropped_total {self.stats.dropped}",
+            "# HELP email_smtp_connects_total SMTP sessions opened.",
+            "# TYPE email_smtp_connects_total counter",
+            f"email_smtp_connects_total {self.stats.connects}",
+        ]) + "\n"
+
+
+mail_queue = MailQueue(
+    max_size=EMAIL_QUEUE_SIZE,
+    workers=SMTP_POOL_SIZE,
+    batch_size=SMTP_BATCH_SIZE,
+    idle_timeout=SMTP_IDLE_TIMEOUT_SECONDS,
+)
+
+
+def queue_email(recipient: str, subject: str, body: str) -> bool:
+    """Fire-and-forget send for request handlers; never blocks the request."""
+    return mail_queue.enqueue(recipient, subject, body)
+
+
+async def send_email(recipient: str, subject: str, body: str) -> bool:
+    """Send and wait for the outcome. Returns True once the SMTP server accepted the message."""
+    return await mail_queue.send(recipient, subject, body)
+
+
+# ----------------------------
+# Transactional outbox
+# ----------------------------
+MAX_RETRY_BACKOFF_SECONDS = 3600
+PURGE_INTERVAL_SECONDS = 3600
+REDACTED_BODY = ""  # bodies can hold one-time codes; don't keep them once a row is settled
+
+
+def add_to_outbox(db: AsyncSession, recipient: str, subject: str, body: str) -> EmailOutbox:
+    """
+    Stage an email in the caller's transaction: it is sent if and only if the
+    transaction commits. Call outbox_dispatcher.wake() after the commit to send
+    it right away instead of on the next poll.
+    """
+    entry = EmailOutbox(recipient=recipient, subject=subject, body=body)
+    db.add(entry)
+    return entry
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(EMAIL_OUTBOX_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_RETRY_BACKOFF_SECONDS))
+
+
+class OutboxDispatcher:
+    """
+    Sends email_outbox rows through the mail queue, at least once.
+    Each pass claims up to `batch_size` due rows by setting a lease
+    (FOR UPDATE SKIP LOCKED, so several app instances never claim the same row),
+    sends them, and records the outcome. Failed rows are retried with exponential
+    backoff until `max_attempts`; rows whose lease expires (the process died
+    mid-send) are picked up again. Once a row is sent or given up on its body is
+    cleared, since it may hold a one-time code.
+    """
+
+    def __init__(self, mail: MailQueue, batch_size: int, poll_interval: float, lease_seconds: int, max_attempts: int):
+        self.mail = mail
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _claim(self) -> list:
+        now = datetime.now()
+        due = (
+            select(EmailOutbox.id)
+            .where(
+                EmailOutbox.status == "pending",
+                EmailOutbox.next_attempt_at <= now,
+                EmailOutbox.locked_until.is_(None) | (EmailOutbox.locked_until < now),
+            )
+            .order_by(EmailOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
         )
-        print("✅ Email sent successfully!")
-    except Exception as e:
-        print(f"❌ EMAIL SEND ERROR: {type(e).__name__}: {e}")
+        async with SessionLocal() as db:
+            claimed = (await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_(due.scalar_subquery()))
+                .values(locked_until=now + timedelta(seconds=self.lease_seconds), attempts=EmailOutbox.attempts + 1)
+                .returning(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.body, EmailOutbox.attempts)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        return claimed
+
+    async def _record(self, sent_ids: List[int], failures: List[tuple]) -> None:
+        now = datetime.now()
+        async with SessionLocal() as db:
+            if sent_ids:
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_(sent_ids))
+                    .values(status="sent", sent_at=now, locked_until=None, last_error=None, body=REDACTED_BODY)
+                )
+            for entry, error in failures:
+                values = {"locked_until": None, "last_error": error}
+                if entry.attempts >= self.max_attempts:
+                    values["status"] = "failed"
+                    values["body"] = REDACTED_BODY
+                    self.failed += 1
+                    print(f"Giving up on outbox email {entry.id} to {entry.recipient} after {entry.attempts} attempts: {error}")
+                else:
+                    values["next_attempt_at"] = now + retry_delay(entry.attempts)
+                    self.retried += 1
+                await db.execute(update(EmailOutbox).where(EmailOutbox.id == entry.id).values(**values))
+            await db.commit()
+
+    async def dispatch_once(self) -> int:
+        """Claim and send one batch; returns how many rows were claimed."""
+        claimed = await self._claim()
+        if not claimed:
+            return 0
+        outbound = [await self.mail.submit(entry.recipient, entry.subject, entry.body) for entry in claimed]
+        results = await asyncio.gather(*(item.result for item in outbound))
+        sent_ids = [entry.id for entry, ok in zip(claimed, results) if ok]
+        failures = [
+            (entry, item.error or "delivery failed")
+            for entry, item, ok in zip(claimed, outbound, results) if not ok
+        ]
+        await self._record(sent_ids, failures)
+        self.sent += len(sent_ids)
+        return len(claimed)
+
+    async def purge_sent(self) -> None:
+        cutoff = datetime.now() - timedelta(days=EMAIL_OUTBOX_RETENTION_DAYS)
+        async with SessionLocal() as db:
+            await db.execute(delete(EmailOutbox).where(EmailOutbox.status == "sent", EmailOutbox.sent_at < cutoff))
+            await db.commit()
 
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            try:
+                # A full batch means more rows are probably due; go again without waiting
+                if await self.dispatch_once() >= self.batch_size:
+                    continue
+                if loop.time() - self._last_purge >= PURGE_INTERVAL_SECONDS:
+                    self._last_purge = loop.time()
+                    await self.purge_sent()
+            except Exception as e:
+                print(f"Email outbox dispatch failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Finish the batch in progress; anything not recorded is resent after its lease expires."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    def render_prometheus(self) -> str:
+        return "\n".join([
+            "# HELP email_outbox_sent_total Outbox emails delivered.",
+            "# TYPE email_outbox_sent_total counter",
+            f"email_outbox_sent_total {self.sent}",
+            "# HELP email_outbox_retries_total Outbox deliveries rescheduled after a failure.",
+            "# TYPE email_outbox_retries_total counter",
+            f"email_outbox_retries_total {self.retried}",
+            "# HELP email_outbox_failed_total Outbox emails given up on after the last attempt.",
+            "# TYPE email_outbox_failed_total counter",
+            f"email_outbox_failed_total {self.failed}",
+        ]) + "\n"
+
+
+outbox_dispatcher = OutboxDispatcher(
+    mail_queue,
+    batch_size=EMAIL_OUTBOX_BATCH_SIZE,
+    poll_interval=EMAIL_OUTBOX_POLL_SECONDS,
+    lease_seconds=EMAIL_OUTBOX_LEASE_SECONDS,
+    max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+)
@@ -0,0 +1,67 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.config import IMAGE_PROCESSING_WORKERS
+
+# ----------------------------
+# Photo renditions
+# ----------------------------
+PHOTO_MAX_DIMENSION = 1024
+THUMBNAIL_SIZES = (64, 128, 256)
+JPEG_QUALITY = 85
+ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG"}
+
+# Refuse decompression bombs well before they exhaust memory
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_PROCESSING_WORKERS, thread_name_prefix="image")
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _encode_jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    # No exif= argument, so camera metadata (GPS etc.) is dropped
+    image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def render_photo(data: bytes) -> Tuple[bytes, Dict[int, bytes]]:
+    """
+    Validate an uploaded photo and re-encode it: upright per its EXIF orientation,
+    flattened to RGB, at most PHOTO_MAX_DIMENSION on the long side, plus one square
+    JPEG thumbnail per THUMBNAIL_SIZES entry. CPU-bound; call via process_photo.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            if probe.format not in ALLOWED_IMAGE_FORMATS:
+                raise InvalidImage(f"Unsupported image format: {probe.format}")
+            probe.verify()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImage(str(e)) from e
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+        image = background
+    else:
+        image = image.convert("RGB")
+
+    image.thumbnail((PHOTO_MAX_DIMENSION, PHOTO_MAX_DIMENSION), Image.Resampling.LANCZOS)
+    thumbnails = {
+        size: _encode_jpeg(ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS))
+        for size in THUMBNAIL_SIZES
+    }
+    return _encode_jpeg(image), thumbnails
+
+
+async def process_photo(data: bytes) -> Tuple[bytes, Dict[int, bytes]]:
+    """Run render_photo on the image worker pool so resizing never blocks the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_image_executor, render_photo, data)
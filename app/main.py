@@ -1,5 +1,8 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from app.profile import user_profile, user_auth, user_settings
 from app.payments import user_payments
 from app.Help_center import help_center
@@ -9,11 +12,55 @@ from app.donation import user_donation
 from app.Purchase import user_purchase, user_cart
 from app.Advance import wallet
 from app.patients_doctors import appointment
+from app.monitoring import metrics
+from app.reference_data import load_reference_data
+from app.medicine_utils import bootstrap_medicine_search, rebuild_similar_products_periodically
+from app.database import master_medicine_collection, similar_products_collection, job_leases_collection
+from app.search_history_utils import search_history_writer
+from app.virus_scan import clamd_pool, document_scan_queue
+from app.email_utils import mail_queue, outbox_dispatcher
+from app.otp_utils import otp_service
+from app.storage_utils import MEDIA_ROOT, PHOTO_PREFIX, ImmutableStaticFiles
+from app.request_metrics import RequestMetricsMiddleware
+from app.config import VIRUS_SCAN_ENABLED, FORWARDED_ALLOW_IPS, SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS
 
-app = FastAPI(title="MedoCRM API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await load_reference_data()
+    # Fails startup on a missing or conflicting index; the derived-field backfill continues in the background
+    medicine_backfill = await bootstrap_medicine_search(master_medicine_collection, similar_products_collection)
+    background_jobs = [medicine_backfill]
+    if SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS > 0:
+        background_jobs.append(asyncio.create_task(rebuild_similar_products_periodically(
+            master_medicine_collection, similar_products_collection, job_leases_collection,
+            SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS,
+        )))
+    search_history_writer.start()
+    mail_queue.start()
+    outbox_dispatcher.start()
+    if VIRUS_SCAN_ENABLED:
+        document_scan_queue.start()
+    yield
+    await search_history_writer.stop()
+    await document_scan_queue.stop()
+    await outbox_dispatcher.stop()
+    await mail_queue.stop()
+    clamd_pool.close()
+    await otp_service.close()
+    for job in background_jobs:
+        job.cancel()
+
+
+app = FastAPI(title="MedoCRM API", lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+# Outermost, so request.client is the real client (X-Forwarded-For from trusted proxies only)
+app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=FORWARDED_ALLOW_IPS)
 
 # Mount static files for serving uploaded images
 app.mount("/static", StaticFiles(directory="app"), name="static")
+# Content-addressed photos and thumbnails; names change whenever content does
+app.mount("/media/photos", ImmutableStaticFiles(directory=MEDIA_ROOT / PHOTO_PREFIX, check_dir=False), name="photos")
 
 app.include_router(user_auth.router)
 app.include_router(user_profile.router)
@@ -28,6 +75,7 @@ app.include_router(user_cart.router)
 app.include_router(wallet.router)
 app.include_router(appointment.router)
 app.include_router(user_patients.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 def root():
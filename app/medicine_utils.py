@@ -0,0 +1,414 @@
+import asyncio
+import heapq
+import re
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# ----------------------------
+# Derived search fields on master_medicine
+# ----------------------------
+# name_key:      normalized product name, used for anchored prefix lookups
+# search_tokens: edge n-grams of every word in the name, used for word-prefix lookups
+# compounds:     normalized, de-duplicated salts from compound_1..compound_24
+NAME_KEY_FIELD = "name_key"
+SEARCH_TOKENS_FIELD = "search_tokens"
+COMPOUNDS_FIELD = "compounds"
+COMPOUND_SLOTS = 24
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 20
+BACKFILL_BATCH_SIZE = 1000
+
+# Precomputed substitutes, one document per product in the similar_products collection.
+# Rebuilt every SIMILAR_PRODUCTS_REBUILD_INTERVAL_SECONDS by one worker, or on demand with
+# python -m app.medicine_utils (e.g. right after a catalogue load).
+SIMILAR_PRODUCTS_TOP_K = 50
+LIVE_SUBSTITUTE_CANDIDATES = 500
+
+# Projection that hides derived fields from API responses
+PUBLIC_PROJECTION = {"_id": 0, NAME_KEY_FIELD: 0, SEARCH_TOKENS_FIELD: 0, COMPOUNDS_FIELD: 0}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and collapse everything but letters/digits to single spaces."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    ascii_text = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    return " ".join(_WORD_RE.findall(ascii_text))
+
+
+def build_search_tokens(product_name: str) -> List[str]:
+    """Edge n-grams (word prefixes) for every word of the product name."""
+    tokens = set()
+    for word in normalize_text(product_name).split():
+        for length in range(MIN_TOKEN_LENGTH, min(len(word), MAX_TOKEN_LENGTH) + 1):
+            tokens.add(word[:length])
+    return sorted(tokens)
+
+
+def search_fields(product_name: str) -> Dict[str, object]:
+    """Derived fields to $set on a master_medicine document whenever product_name is written."""
+    return {
+        NAME_KEY_FIELD: normalize_text(product_name),
+        SEARCH_TOKENS_FIELD: build_search_tokens(product_name),
+    }
+
+
+def build_compounds(product: dict) -> List[str]:
+    """Normalized salts of a product in slot order, without duplicates or blanks."""
+    compounds = []
+    for i in range(1, COMPOUND_SLOTS + 1):
+        compound = normalize_text(product.get(f"compound_{i}") or "")
+        if compound and compound not in compounds:
+            compounds.append(compound)
+    return compounds
+
+
+def derived_fields(product: dict) -> Dict[str, object]:
+    """All derived fields to $set on a master_medicine document at ingest."""
+    fields = search_fields(product.get("product_name", ""))
+    fields[COMPOUNDS_FIELD] = build_compounds(product)
+    return fields
+
+
+def product_compounds(product: dict) -> List[str]:
+    """Compounds of a product document, falling back to the raw slots if not yet backfilled."""
+    compounds = product.get(COMPOUNDS_FIELD)
+    return compounds if compounds is not None else build_compounds(product)
+
+
+def query_tokens(query: str) -> List[str]:
+    """Tokens a search string must match, most selective (longest) first."""
+    words = {word[:MAX_TOKEN_LENGTH] for word in normalize_text(query).split() if len(word) >= MIN_TOKEN_LENGTH}
+    return sorted(words, key=len, reverse=True)
+
+
+# ----------------------------
+# Search
+# ----------------------------
+def _relevance(doc: dict, normalized_query: str, first_word: str) -> tuple:
+    name = doc.get(NAME_KEY_FIELD) or normalize_text(doc.get("product_name", ""))
+    if name == normalized_query:
+        rank = 0
+    elif name.startswith(normalized_query):
+        rank = 1
+    elif name.startswith(first_word):
+        rank = 2
+    else:
+        rank = 3
+    return rank, len(name), name
+
+
+async def search_medicines(collection: AsyncIOMotorCollection, name: str, limit: int) -> List[dict]:
+    """
+    Ranked medicine search served from indexes:
+    1. names starting with the whole query (anchored prefix on name_key)
+    2. names containing a word starting with every query word (search_tokens)
+    3. substring match on product_name for documents not yet given derived fields
+    """
+    normalized_query = normalize_text(name)
+    tokens = query_tokens(name)
+    if not normalized_query:
+        return []
+
+    projection = {"_id": 1, "product_name": 1, NAME_KEY_FIELD: 1}
+    prefix_cursor = collection.find(
+        {NAME_KEY_FIELD: {"$regex": f"^{re.escape(normalized_query)}"}}, projection
+    ).limit(limit)
+    matches = await prefix_cursor.to_list(length=limit)
+
+    if tokens and len(matches) < limit:
+        seen = [doc["_id"] for doc in matches]
+        candidate_limit = max(limit * 5, 200)
+        token_cursor = collection.find(
+            {SEARCH_TOKENS_FIELD: {"$all": tokens}, "_id": {"$nin": seen}}, projection
+        ).limit(candidate_limit)
+        matches += await token_cursor.to_list(length=candidate_limit)
+
+    if len(matches) < limit:
+        # Documents ingested since the last backfill have no derived fields yet;
+        # name_key: null is an index seek, so this costs nothing once they are filled
+        remaining = limit - len(matches)
+        legacy_cursor = collection.find(
+            {NAME_KEY_FIELD: None, "product_name": {"$regex": re.escape(name.strip()), "$options": "i"}}, projection
+        ).limit(remaining)
+        matches += await legacy_cursor.to_list(length=remaining)
+
+    first_word = normalized_query.split()[0]
+    matches.sort(key=lambda doc: _relevance(doc, normalized_query, first_word))
+    ranked_ids = [doc["_id"] for doc in matches[:limit]]
+    if not ranked_ids:
+        return []
+
+    docs = await collection.find(
+        {"_id": {"$in": ranked_ids}}, {NAME_KEY_FIELD: 0, SEARCH_TOKENS_FIELD: 0, COMPOUNDS_FIELD: 0}
+    ).to_list(length=limit)
+    by_id = {doc.pop("_id"): doc for doc in docs}
+    return [by_id[_id] for _id in ranked_ids if _id in by_id]
+
+
+# ----------------------------
+# Salt / substitute lookups
+# ----------------------------
+def salt_filter(salt: str) -> dict:
+    """
+    Match products having a compound that starts with the given salt (index range scan).
+    Documents ingested since the last backfill have no compounds yet and are
+    matched on the raw compound_N slots instead; compounds: null is an index seek.
+    """
+    raw_prefix = {"$regex": f"^{re.escape(salt.strip())}", "$options": "i"}
+    return {"$or": [
+        {COMPOUNDS_FIELD: {"$regex": f"^{re.escape(normalize_text(salt))}"}},
+        {COMPOUNDS_FIELD: None, "$or": [{f"compound_{i}": raw_prefix} for i in range(1, COMPOUND_SLOTS + 1)]},
+    ]}
+
+
+def is_same_product(product: dict, other: dict) -> bool:
+    """Substitutes never include the product itself or other SKUs sold under the same name."""
+    return other.get("product_name") == product.get("product_name")
+
+
+def substitutes_filter(product: dict) -> dict:
+    """Match other products sharing at least one compound with `product` (see is_same_product)."""
+    return {
+        COMPOUNDS_FIELD: {"$in": product_compounds(product)},
+        "product_name": {"$ne": product.get("product_name")},
+    }
+
+
+# ----------------------------
+# Precomputed substitutes (compound-overlap neighbours)
+# ----------------------------
+def compound_overlap(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity of two compound sets."""
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def rank_substitutes(product: dict, candidates: Iterable[dict], top_k: int) -> List[dict]:
+    """Top-K candidates by compound overlap with `product`, best first."""
+    own = frozenset(product_compounds(product))
+    scored = []
+    for candidate in candidates:
+        if is_same_product(product, candidate):
+            continue
+        score = compound_overlap(own, frozenset(product_compounds(candidate)))
+        if score > 0:
+            scored.append((score, candidate.get("product_name") or "", candidate))
+    best = heapq.nsmallest(top_k, scored, key=lambda item: (-item[0], item[1]))
+    return [
+        {"product_id": c.get("product_id"), "product_name": c.get("product_name"), "score": round(score, 4)}
+        for score, _, c in best
+    ]
+
+
+def _neighbour_document(product: dict, neighbours: List[dict]) -> UpdateOne:
+    return UpdateOne(
+        {"product_id": product.get("product_id")},
+        {"$set": {
+            "product_id": product.get("product_id"),
+            "product_name": product.get("product_name"),
+            "compounds": sorted(product_compounds(product)),
+            "neighbours": neighbours,
+            "computed_at": datetime.now(),
+        }},
+        upsert=True,
+    )
+
+
+async def rebuild_similar_products(
+    collection: AsyncIOMotorCollection,
+    neighbours_collection: AsyncIOMotorCollection,
+    top_k: int = SIMILAR_PRODUCTS_TOP_K,
+) -> int:
+    """
+    Offline job: recompute the top-K substitutes of every product.
+    Candidates come from an in-memory compound -> products posting list, so each
+    product only scores the products it actually shares a compound with.
+    """
+    products: Dict[str, dict] = {}
+    postings: Dict[str, List[str]] = {}
+    projection = {"_id": 0, "product_id": 1, "product_name": 1, COMPOUNDS_FIELD: 1,
+                  **{f"compound_{i}": 1 for i in range(1, COMPOUND_SLOTS + 1)}}
+    async for doc in collection.find({}, projection):
+        product_id = doc.get("product_id")
+        if not product_id:
+            continue
+        compounds = frozenset(product_compounds(doc))
+        products[product_id] = {"product_id": product_id, "product_name": doc.get("product_name"), "compounds": compounds}
+        for compound in compounds:
+            postings.setdefault(compound, []).append(product_id)
+
+    written = 0
+    operations = []
+    for product_id, product in products.items():
+        shared = Counter()
+        for compound in product["compounds"]:
+            shared.update(postings[compound])
+        scored = []
+        for other_id, overlap in shared.items():
+            other = products[other_id]
+            if is_same_product(product, other):
+                continue
+            score = overlap / (len(product["compounds"]) + len(other["compounds"]) - overlap)
+            scored.append((score, other["product_name"] or "", other_id))
+        best = heapq.nsmallest(top_k, scored, key=lambda item: (-item[0], item[1]))
+        neighbours = [
+            {"product_id": other_id, "product_name": name, "score": round(score, 4)}
+            for score, name, other_id in best
+        ]
+        operations.append(_neighbour_document(product, neighbours))
+        if len(operations) >= BACKFILL_BATCH_SIZE:
+            await neighbours_collection.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+            await asyncio.sleep(0)
+    if operations:
+        await neighbours_collection.bulk_write(operations, ordered=False)
+        written += len(operations)
+    return written
+
+
+async def acquire_lease(leases: AsyncIOMotorCollection, name: str, seconds: float) -> bool:
+    """Claim a named job for `seconds` across all workers; False if someone else holds it."""
+    now = datetime.now()
+    try:
+        await leases.find_one_and_update(
+            {"_id": name, "expires_at": {"$lte": now}},
+            {"$set": {"expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:  # the lease exists and has not expired
+        return False
+    return True
+
+
+async def rebuild_similar_products_periodically(
+    collection: AsyncIOMotorCollection,
+    neighbours_collection: AsyncIOMotorCollection,
+    leases: AsyncIOMotorCollection,
+    interval: float,
+) -> None:
+    """Rebuild similar_products every `interval` seconds; a lease keeps it to one worker per interval."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await acquire_lease(leases, "rebuild_similar_products", interval * 0.9):
+                count = await rebuild_similar_products(collection, neighbours_collection)
+                print(f"Computed substitutes for {count} products")
+        except Exception as e:
+            print(f"Similar products rebuild failed: {e}")
+
+
+async def get_substitutes(
+    collection: AsyncIOMotorCollection,
+    neighbours_collection: AsyncIOMotorCollection,
+    product: dict,
+    limit: int,
+) -> List[dict]:
+    """
+    Substitutes ranked by compound overlap, read from the precomputed neighbour list.
+    Products added or re-formulated since the last rebuild are ranked live instead.
+    """
+    entry = await neighbours_collection.find_one(
+        {"product_id": product.get("product_id")}, {"neighbours": 1, "compounds": 1}
+    )
+    if entry is not None and entry.get("compounds") == sorted(product_compounds(product)):
+        neighbours = entry.get("neighbours", [])[:limit]
+    else:
+        # Not computed yet, or computed for different compounds: rank live candidates
+        candidates = await collection.find(
+            substitutes_filter(product), {"_id": 0}
+        ).limit(LIVE_SUBSTITUTE_CANDIDATES).to_list(length=LIVE_SUBSTITUTE_CANDIDATES)
+        neighbours = rank_substitutes(product, candidates, limit)
+
+    ids = [n["product_id"] for n in neighbours]
+    docs = await collection.find({"product_id": {"$in": ids}}, PUBLIC_PROJECTION).to_list(length=len(ids))
+    by_id = {doc.get("product_id"): doc for doc in docs}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+# ----------------------------
+# Index bootstrap
+# ----------------------------
+MEDICINE_INDEXES = {
+    "name_key_1": NAME_KEY_FIELD,
+    "search_tokens_1": SEARCH_TOKENS_FIELD,
+    "compounds_1": COMPOUNDS_FIELD,
+    "product_name_1": "product_name",
+    "product_id_1": "product_id",
+}
+
+
+async def ensure_medicine_indexes(collection: AsyncIOMotorCollection) -> None:
+    """Create (idempotently) and verify the indexes the medicine endpoints rely on."""
+    for index_name, field in MEDICINE_INDEXES.items():
+        await collection.create_index([(field, ASCENDING)], name=index_name)
+
+    existing = await collection.index_information()
+    missing = set(MEDICINE_INDEXES) - set(existing)
+    if missing:
+        raise RuntimeError(f"master_medicine is missing indexes: {', '.join(sorted(missing))}")
+
+
+async def ensure_similar_products_indexes(neighbours_collection: AsyncIOMotorCollection) -> None:
+    await neighbours_collection.create_index([("product_id", ASCENDING)], name="product_id_1", unique=True)
+
+
+async def backfill_derived_fields(collection: AsyncIOMotorCollection) -> int:
+    """Populate derived fields on documents ingested without them."""
+    projection = {"_id": 1, "product_name": 1, **{f"compound_{i}": 1 for i in range(1, COMPOUND_SLOTS + 1)}}
+    updated = 0
+    while True:
+        cursor = collection.find(
+            {"$or": [{NAME_KEY_FIELD: {"$exists": False}}, {COMPOUNDS_FIELD: {"$exists": False}}]}, projection
+        ).limit(BACKFILL_BATCH_SIZE)
+        batch = await cursor.to_list(length=BACKFILL_BATCH_SIZE)
+        if not batch:
+            return updated
+        await collection.bulk_write(
+            [UpdateOne({"_id": doc["_id"]}, {"$set": derived_fields(doc)}) for doc in batch],
+            ordered=False,
+        )
+        updated += len(batch)
+
+
+async def bootstrap_medicine_search(
+    collection: AsyncIOMotorCollection, neighbours_collection: AsyncIOMotorCollection
+) -> asyncio.Task:
+    """
+    Create and check the medicine indexes, raising if any is missing or conflicts,
+    so startup fails instead of serving unindexed queries. Then start the
+    derived-field backfill in the background and return its task; the backfill is
+    best-effort, since search falls back to raw fields for unfilled documents.
+    """
+    await ensure_medicine_indexes(collection)
+    await ensure_similar_products_indexes(neighbours_collection)
+    return asyncio.create_task(_backfill_in_background(collection))
+
+
+async def _backfill_in_background(collection: AsyncIOMotorCollection) -> None:
+    try:
+        updated = await backfill_derived_fields(collection)
+        if updated:
+            print(f"Backfilled derived fields on {updated} master_medicine documents")
+    except Exception as e:
+        print(f"Medicine search backfill failed: {e}")
+
+
+if __name__ == "__main__":
+    # On-demand rebuild, e.g. after a catalogue load: python -m app.medicine_utils
+    from app.database import master_medicine_collection, similar_products_collection
+
+    count = asyncio.run(rebuild_similar_products(master_medicine_collection, similar_products_collection))
+    print(f"Computed substitutes for {count} products")
@@ -5,11 +5,12 @@ from sqlalchemy import (
     Boolean, Enum,
     DateTime, TIMESTAMP,
     Date, Time,
-    ForeignKey,
+    ForeignKey, Index,
     JSON, Enum,
     Numeric, ARRAY,
 )
 import enum
+from functools import lru_cache
 from datetime import time, datetime, date
 from sqlalchemy import func
 from app.database import Base
@@ -28,6 +29,7 @@ class User(Base):
     email = Column(String(254), unique=True, nullable=False)
     phone_country_code = Column(String(8), nullable=True)
     phone_number = Column(String(20), nullable=True)
+    phone_e164 = Column(String(20), nullable=True, index=True)  # normalized by contact_utils, used for lookups
     password = Column(String(255), nullable=False)
     user_type = Column(String(32), nullable=False)
     created_at = Column(DateTime, nullable=False)
@@ -43,6 +45,8 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     last_login = Column(DateTime, nullable=True)
     last_login_ip = Column(String, nullable=True, default=None)
+
+    __table_args__ = (Index("ix_registration_user_email_lower", func.lower(email)),)
     
     profile = relationship("UserProfile", back_populates="user", uselist=False)
     donations = relationship("Donation", back_populates="user", cascade="all, delete")
@@ -321,6 +325,8 @@ class Donation(Base):
     ngopost = relationship("NGOPost", back_populates="donations")
     user = relationship("User", back_populates="donations")
 
+    __table_args__ = (Index("ix_donate_donation_post_user", "ngopost_id", "user_id"),)
+
     def __str__(self):
         return f"Donation by {self.user_id} to post {self.ngopost_id} - {self.amount}"
     
@@ -329,6 +335,23 @@ class DonationFrequencyEnum(str, enum.Enum):
     ONETIME = "One-time"
     WEEKLY = "Weekly"
     MONTHLY = "Monthly"
+
+class DonationsAllowed(enum.IntEnum):
+    """How many times one user may donate to a post."""
+    ONE = 1
+    TWO = 2
+    THREE = 3
+
+@lru_cache(maxsize=64)
+def parse_donations_allowed(frequency: str) -> DonationsAllowed:
+    freq = (frequency or "once").lower()
+    if "one" in freq:
+        return DonationsAllowed.ONE
+    if "two" in freq:
+        return DonationsAllowed.TWO
+    if "three" in freq:
+        return DonationsAllowed.THREE
+    return DonationsAllowed.ONE
     
 class CountryOption(Base):
     __tablename__ = "ngopost_countryoption"
@@ -448,6 +471,10 @@ class NGOPost(Base):
     gender = relationship("GenderOption", backref="posts")
     spending_power = relationship("SpendingPowerOption", backref="posts") 
 
+    @property
+    def donations_allowed(self) -> "DonationsAllowed":
+        return parse_donations_allowed(self.donation_frequency)
+
 class NGOProfile(Base):
     __tablename__ = "registration_ngoprofile"
 
@@ -513,6 +540,8 @@ class RewardHistory(Base):
     action_type_id = Column(Integer, ForeignKey("points_pointsactiontype.id", ondelete="CASCADE"), nullable=False)
     points = Column(Integer, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (Index("ix_points_pointshistory_user_timestamp", "user_id", "timestamp"),)
     
     user = relationship("User", back_populates="points_history")
     action_type = relationship("PointsActionType", back_populates="history")
@@ -520,6 +549,26 @@ class RewardHistory(Base):
     def __str__(self):
         return f"{self.user.email} - {self.action_type.action_type} - {self.points} pts"
 
+class UserPointsTotal(Base):
+    """All-time points per user, maintained alongside every RewardHistory insert."""
+    __tablename__ = "points_userpointstotal"
+
+    user_id = Column(Integer, ForeignKey("registration_user.id", ondelete="CASCADE"), primary_key=True)
+    total_points = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+class UserPointsRollup(Base):
+    """Points per user, action type and calendar month (month = first day of the month)."""
+    __tablename__ = "points_userpointsrollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("registration_user.id", ondelete="CASCADE"), nullable=False)
+    action_type_id = Column(Integer, ForeignKey("points_pointsactiontype.id", ondelete="CASCADE"), nullable=False)
+    month = Column(Date, nullable=False)
+    points = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (UniqueConstraint("user_id", "action_type_id", "month", name="uq_points_rollup"),)
+
 class PointsActionType(Base):
     __tablename__ = "points_pointsactiontype"
     
@@ -780,8 +829,19 @@ class WalletTransaction(Base):
     current_balance = Column(DECIMAL(12, 2), nullable=False)
     created_at = Column(DateTime, default=datetime.now, nullable=False)
 
+    __table_args__ = (Index("ix_wallet_transactions_user_created", "user_id", "created_at"),)
+
     user = relationship("User", backref="wallet_transactions")
 
+class WalletBalance(Base):
+    """Current balance per user, updated in the same transaction as each WalletTransaction."""
+    __tablename__ = "wallet_balances"
+
+    user_id = Column(Integer, ForeignKey("registration_user.id", ondelete="CASCADE"), primary_key=True)
+    balance = Column(DECIMAL(12, 2), nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
 #-------------------------------------------------------------------------------
 # Appointments
 #--------------------------------------------------------------------------------
@@ -858,3 +918,53 @@ class SearchHistory(Base):
     __table_args__ = (UniqueConstraint("user_id", "mongo_id", name="uq_search_history"),)
 
     user = relationship("User", back_populates="search_clicks")
+
+#--------------------------------------------------------------------------------
+# File storage
+#--------------------------------------------------------------------------------
+
+class DocumentScanResult(Base):
+    """Final virus-scan outcome for a stored document that will never be marked clean (infected or missing)."""
+    __tablename__ = "storage_documentscanresult"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ngo_profile_id = Column(Integer, ForeignKey("registration_ngoprofile.id", ondelete="CASCADE"), nullable=False)
+    field = Column(String(64), nullable=False)
+    stored_path = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False)  # infected / missing
+    signature = Column(String(255), nullable=True)
+    scanned_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (UniqueConstraint("ngo_profile_id", "field", "stored_path", name="uq_document_scan_result"),)
+
+class StorageBlob(Base):
+    """Reference count for a content-addressed upload under app/uploads/blobs."""
+    __tablename__ = "storage_blob"
+
+    path = Column(String(255), primary_key=True)
+    ref_count = Column(Integer, default=0, nullable=False)
+    scan_status = Column(String(20), nullable=True)  # clean / infected / missing; NULL until clamd has checked it
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+#--------------------------------------------------------------------------------
+# Email outbox
+#--------------------------------------------------------------------------------
+
+class EmailOutbox(Base):
+    """Email written in the same transaction as the row that triggered it; sent by email_utils.OutboxDispatcher."""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending / sent / failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.now, nullable=False)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),)
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.database import engine
+from app.pool_metrics import pool_snapshot
+from app.request_metrics import render_prometheus
+from app.email_utils import mail_queue, outbox_dispatcher
+from app.profile.user_auth import check_authorization_key
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Monitoring"]
+)
+
+# GET /metrics - Prometheus text format: per-route requests, latency, SQL and Mongo work, pool usage, mail queue
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics(_auth=Depends(check_authorization_key)):
+    return PlainTextResponse(render_prometheus(engine) + mail_queue.render_prometheus() + outbox_dispatcher.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# GET /metrics/db-pool - Connection pool usage, checkout waits and per-route hold times
+@router.get("/db-pool")
+async def get_db_pool_metrics(_auth=Depends(check_authorization_key)):
+    return pool_snapshot(engine)
@@ -1,21 +1,198 @@
-import pyotp
-import binascii
-
-def generate_otp_secret():
-    return pyotp.random_base32()
-
-def generate_otp(secret: str) -> str:
-    try:
-        return pyotp.TOTP(secret).now()
-    except (binascii.Error, ValueError) as e:
-        print(f"Error generating OTP: {e}")
-        return None
-
-def verify_otp(secret: str, otp: str) -> bool:
-    try:
-        if not secret or not otp:
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Dict, Optional, Tuple
+from app.config import (
+    SECRET_KEY,
+    OTP_STORE_URL,
+    OTP_LENGTH,
+    OTP_TTL_SECONDS,
+    OTP_MAX_ATTEMPTS,
+    OTP_CONTACT_LIMIT,
+    OTP_IP_LIMIT,
+    OTP_RATE_WINDOW_SECONDS,
+)
+
+MEMORY_STORE_MAX_KEYS = 100_000
+
+
+class OTPRateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+# ----------------------------
+# Key-value stores
+# ----------------------------
+class MemoryKVStore:
+    """
+    Expiring key-value store in process memory. Codes are only visible to the
+    worker that issued them, so use Redis when running more than one worker.
+    """
+
+    def __init__(self, max_keys: int = MEMORY_STORE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data: Dict[str, Tuple[float, object]] = {}
+
+    def _live(self, key: str) -> Optional[Tuple[float, object]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def _make_room(self) -> None:
+        if len(self._data) < self.max_keys:
+            return
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+        while len(self._data) >= self.max_keys:
+            # dicts keep insertion order, so this evicts the oldest key
+            del self._data[next(iter(self._data))]
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._live(key)
+        return entry[1] if entry else None
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        self._data.pop(key, None)
+        self._make_room()
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def incr(self, key: str, ttl: int) -> Tuple[int, int]:
+        """Increment a counter, starting its `ttl` window on first use. Returns (count, seconds left)."""
+        entry = self._live(key)
+        if entry is None:
+            self._make_room()
+            entry = (time.monotonic() + ttl, 0)
+        expires_at, count = entry
+        self._data[key] = (expires_at, count + 1)
+        return count + 1, max(1, int(expires_at - time.monotonic()))
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def close(self) -> None:
+        self._data.clear()
+
+
+class RedisKVStore:
+    """Same interface on Redis (redis.asyncio), shared by every worker."""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("OTP_STORE_URL is set but the redis package is not installed") from e
+        self.client = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self.client.set(key, value, ex=ttl)
+
+    async def incr(self, key: str, ttl: int) -> Tuple[int, int]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            count, _, remaining = await pipe.incr(key).expire(key, ttl, nx=True).ttl(key).execute()
+        return count, max(1, remaining)
+
+    async def delete(self, *keys: str) -> None:
+        await self.client.delete(*keys)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_store(url: str):
+    return RedisKVStore(url) if url else MemoryKVStore()
+
+
+# ----------------------------
+# One-time codes
+# ----------------------------
+class OTPService:
+    """
+    Issues short-lived numeric codes and checks them. Only an HMAC of each code
+    is stored, under a key for (purpose, contact); a code is single-use, expires
+    after `ttl` seconds and is burnt after `max_attempts` wrong guesses.
+    Issuing is rate-limited per contact and per client IP.
+    """
+
+    def __init__(self, store, ttl: int, max_attempts: int, contact_limit: int, ip_limit: int, window: int, length: int):
+        self.store = store
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.contact_limit = contact_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        self.length = length
+
+    @staticmethod
+    def _contact(contact: str) -> str:
+        return contact.strip().lower()
+
+    def _digest(self, purpose: str, contact: str, code: str) -> str:
+        message = f"{purpose}:{contact}:{code}".encode()
+        return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    async def _check_rate(self, key: str, limit: int) -> None:
+        count, remaining = await self.store.incr(key, self.window)
+        if count > limit:
+            raise OTPRateLimited(remaining)
+
+    async def issue(self, purpose: str, contact: str, client_ip: Optional[str] = None) -> str:
+        """Create and store a new code for `contact`, replacing any earlier one. Raises OTPRateLimited."""
+        contact = self._contact(contact)
+        if client_ip:
+            await self._check_rate(f"otp:rate:ip:{client_ip}", self.ip_limit)
+        await self._check_rate(f"otp:rate:contact:{purpose}:{contact}", self.contact_limit)
+
+        code = f"{secrets.randbelow(10 ** self.length):0{self.length}d}"
+        await self.store.delete(f"otp:attempts:{purpose}:{contact}")
+        await self.store.set(f"otp:code:{purpose}:{contact}", self._digest(purpose, contact, code), self.ttl)
+        return code
+
+    async def bind(self, purpose: str, contact: str) -> str:
+        """Opaque token naming the contact a code was just issued to; it lives as long as the code."""
+        token = secrets.token_urlsafe(24)
+        await self.store.set(f"otp:token:{purpose}:{token}", self._contact(contact), self.ttl)
+        return token
+
+    async def bound_contact(self, purpose: str, token: str) -> Optional[str]:
+        return await self.store.get(f"otp:token:{purpose}:{token}") if token else None
+
+    async def verify(self, purpose: str, contact: str, code: str) -> bool:
+        contact = self._contact(contact)
+        code_key = f"otp:code:{purpose}:{contact}"
+        attempts_key = f"otp:attempts:{purpose}:{contact}"
+        stored = await self.store.get(code_key)
+        if not stored or not code:
+            return False
+
+        attempts, _ = await self.store.incr(attempts_key, self.ttl)
+        if attempts > self.max_attempts:
+            await self.store.delete(code_key, attempts_key)
+            return False
+        if not hmac.compare_digest(stored, self._digest(purpose, contact, code.strip())):
             return False
-        return pyotp.TOTP(secret).verify(otp, valid_window=5)
-    except (binascii.Error, ValueError) as e:
-        print(f"Error verifying OTP: {e}")
-        return False
+        await self.store.delete(code_key, attempts_key)
+        return True
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+otp_service = OTPService(
+    create_store(OTP_STORE_URL),
+    ttl=OTP_TTL_SECONDS,
+    max_attempts=OTP_MAX_ATTEMPTS,
+    contact_limit=OTP_CONTACT_LIMIT,
+    ip_limit=OTP_IP_LIMIT,
+    window=OTP_RATE_WINDOW_SECONDS,
+    length=OTP_LENGTH,
+)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
@@ -6,13 +6,14 @@ from typing import List
 from sqlalchemy import update
 from app.database import get_db
 from app.models import (
-    DoctorAppointment, HealthIssue, Specialization,
+    DoctorAppointment,
     AppointmentHealthIssues, AppointmentSpecializations, UserAddress
 )
 from app.schemas import (
     DoctorAppointmentCreate, DoctorAppointmentResponse, DoctorAppointmentUpdate
 )
 from app.profile.user_auth import get_current_user_object
+from app.reference_data import reference_response
 
 router = APIRouter(
     prefix="/doctor/appointment",
@@ -73,13 +74,8 @@ async def book_appointment(
 
 # 2. Get dropdown values (GET)
 @router.get("/dropdowns")
-async def get_dropdowns(db: AsyncSession = Depends(get_db)):
-    health_issues = (await db.execute(select(HealthIssue))).scalars().all()
-    specializations = (await db.execute(select(Specialization))).scalars().all()
-    return {
-        "health_issues": [{"id": h.id, "name": h.name} for h in health_issues],
-        "specializations": [{"id": s.id, "name": s.name} for s in specializations]
-    }
+async def get_dropdowns(request: Request):
+    return await reference_response(request, "appointment_dropdowns")
 
 
 # 1. Appointment List
@@ -0,0 +1,231 @@
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import Date, and_, cast, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import RewardHistory, UserPointsTotal, UserPointsRollup
+from app.reference_data import get_reference_table
+
+
+# ----------------------------
+# Month helpers
+# ----------------------------
+# Rollup months are UTC calendar months, both here and in the SQL that seeds them,
+# so neither the app server's nor the DB session's timezone moves a record between rows.
+def _utc(value: datetime) -> datetime:
+    # Naive values are local time, which is also how asyncpg sends them to timestamptz columns
+    return value.astimezone(timezone.utc)
+
+
+def month_start(value: datetime) -> date:
+    value = _utc(value)
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _as_datetime(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+# ----------------------------
+# Ledger writes
+# ----------------------------
+async def _seed_ledger(db: AsyncSession, user_id: int) -> None:
+    """Create the user's ledger rows from existing history the first time they earn points."""
+    # Primary-key probe first, so the history is only summed once per user
+    existing = await db.execute(select(UserPointsTotal.user_id).where(UserPointsTotal.user_id == user_id))
+    if existing.first() is not None:
+        return
+
+    seeded = await db.execute(
+        insert(UserPointsTotal)
+        .from_select(
+            ["user_id", "total_points", "updated_at"],
+            select(
+                literal(user_id),
+                func.coalesce(func.sum(RewardHistory.points), 0),
+                func.now(),
+            ).where(RewardHistory.user_id == user_id),
+        )
+        .on_conflict_do_nothing(index_elements=[UserPointsTotal.user_id])
+        .returning(UserPointsTotal.user_id)
+    )
+    if seeded.first() is None:
+        return
+
+    history_month = cast(func.date_trunc("month", func.timezone("UTC", RewardHistory.timestamp)), Date)
+    await db.execute(
+        insert(UserPointsRollup)
+        .from_select(
+            ["user_id", "action_type_id", "month", "points"],
+            select(
+                RewardHistory.user_id,
+                RewardHistory.action_type_id,
+                history_month,
+                func.sum(RewardHistory.points),
+            )
+            .where(RewardHistory.user_id == user_id)
+            .group_by(RewardHistory.user_id, RewardHistory.action_type_id, history_month),
+        )
+        .on_conflict_do_nothing(constraint="uq_points_rollup")
+    )
+
+
+async def record_reward(
+    db: AsyncSession,
+    user_id: int,
+    action_type_id: int,
+    points: int,
+    timestamp: Optional[datetime] = None,
+) -> RewardHistory:
+    """
+    Add a RewardHistory row and apply it to the user's total and monthly rollup
+    in the caller's transaction. Every points award should go through here.
+    """
+    timestamp = timestamp or datetime.now()
+    await _seed_ledger(db, user_id)
+
+    reward = RewardHistory(user_id=user_id, action_type_id=action_type_id, points=points, timestamp=timestamp)
+    db.add(reward)
+
+    await db.execute(
+        update(UserPointsTotal)
+        .where(UserPointsTotal.user_id == user_id)
+        .values(total_points=UserPointsTotal.total_points + points, updated_at=datetime.now())
+    )
+    rollup = insert(UserPointsRollup).values(
+        user_id=user_id, action_type_id=action_type_id, month=month_start(timestamp), points=points
+    )
+    await db.execute(
+        rollup.on_conflict_do_update(
+            constraint="uq_points_rollup",
+            set_={"points": UserPointsRollup.points + rollup.excluded.points},
+        )
+    )
+    return reward
+
+
+# ----------------------------
+# Ledger reads
+# ----------------------------
+async def get_total_points(db: AsyncSession, user_id: int) -> int:
+    """All-time points: a primary-key read, or a one-off SUM for users with no ledger yet."""
+    ledger = await db.get(UserPointsTotal, user_id)
+    if ledger is not None:
+        return ledger.total_points
+    result = await db.execute(select(func.sum(RewardHistory.points)).where(RewardHistory.user_id == user_id))
+    return result.scalar() or 0
+
+
+async def get_filtered_points(
+    db: AsyncSession,
+    user_id: int,
+    action_type_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> int:
+    """
+    Points matching the reward-history filters. Calendar months fully inside the
+    date range are summed from rollups; only the partial months at either edge
+    touch RewardHistory rows.
+    """
+    if await db.get(UserPointsTotal, user_id) is None:
+        # No ledger yet: the rollups are empty, so sum the raw history
+        filters = [RewardHistory.user_id == user_id]
+        if action_type_id is not None:
+            filters.append(RewardHistory.action_type_id == action_type_id)
+        if start_date is not None:
+            filters.append(RewardHistory.timestamp >= start_date)
+        if end_date is not None:
+            filters.append(RewardHistory.timestamp <= end_date)
+        return (await db.execute(select(func.sum(RewardHistory.points)).where(and_(*filters)))).scalar() or 0
+
+    # Full months are [full_from, full_to)
+    full_from = None
+    if start_date is not None:
+        full_from = month_start(start_date)
+        if _utc(start_date) != _as_datetime(full_from):
+            full_from = next_month(full_from)
+    full_to = month_start(end_date) if end_date is not None else None
+
+    if full_from is not None and full_to is not None and full_from >= full_to:
+        full_from = full_to = None
+        rollup_total = 0
+        edges = [and_(RewardHistory.timestamp >= start_date, RewardHistory.timestamp <= end_date)]
+    else:
+        rollup_filters = [UserPointsRollup.user_id == user_id]
+        if action_type_id is not None:
+            rollup_filters.append(UserPointsRollup.action_type_id == action_type_id)
+        if full_from is not None:
+            rollup_filters.append(UserPointsRollup.month >= full_from)
+        if full_to is not None:
+            rollup_filters.append(UserPointsRollup.month < full_to)
+        rollup_total = (
+            await db.execute(select(func.sum(UserPointsRollup.points)).where(and_(*rollup_filters)))
+        ).scalar() or 0
+
+        edges = []
+        if start_date is not None and full_from is not None:
+            edges.append(and_(
+                RewardHistory.timestamp >= start_date,
+                RewardHistory.timestamp < _as_datetime(full_from),
+            ))
+        if end_date is not None and full_to is not None:
+            edges.append(and_(
+                RewardHistory.timestamp >= _as_datetime(full_to),
+                RewardHistory.timestamp <= end_date,
+            ))
+
+    edge_total = 0
+    if edges:
+        raw_filters = [RewardHistory.user_id == user_id, or_(*edges)]
+        if action_type_id is not None:
+            raw_filters.append(RewardHistory.action_type_id == action_type_id)
+        edge_total = (
+            await db.execute(select(func.sum(RewardHistory.points)).where(and_(*raw_filters)))
+        ).scalar() or 0
+
+    return rollup_total + edge_total
+
+
+# ----------------------------
+# Badge resolution
+# ----------------------------
+class BadgeIndex:
+    """
+    Badge ranges sorted by min_points, so a points total resolves to its badge
+    with one bisect. Rebuilt whenever the cached badge_list snapshot changes.
+    """
+
+    def __init__(self, badges: List[dict]):
+        self.badges = sorted(
+            (b for b in badges if b.get("min_points") is not None),
+            key=lambda b: b["min_points"],
+        )
+        self.min_points = [b["min_points"] for b in self.badges]
+
+    def resolve(self, points: int) -> Tuple[Optional[dict], Optional[dict]]:
+        """Return (current badge, next badge) for a points total."""
+        position = bisect_right(self.min_points, points)
+        current = self.badges[position - 1] if position else None
+        if current is not None and current.get("max_points") is not None and points > current["max_points"]:
+            current = None  # falls in a gap between badge ranges
+        upcoming = self.badges[position] if position < len(self.badges) else None
+        return current, upcoming
+
+
+_badge_index: Optional[BadgeIndex] = None
+_badge_index_version = -1
+
+
+async def get_badge_index() -> BadgeIndex:
+    global _badge_index, _badge_index_version
+    table = await get_reference_table("badge_list")
+    if _badge_index is None or table.version != _badge_index_version:
+        _badge_index = BadgeIndex(table.payload)
+        _badge_index_version = table.version
+    return _badge_index
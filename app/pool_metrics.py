@@ -0,0 +1,110 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.config import DB_POOL_SLOW_CHECKOUT_SECONDS
+
+# ASGI scope of the request being served, so pool events can be attributed to a route.
+# Set by request_metrics.RequestMetricsMiddleware.
+request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+
+def current_route() -> str:
+    """Route template of the current request (e.g. "/donation/pay/{post_id}"), bounded in cardinality."""
+    scope = request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+# ----------------------------
+# Pool statistics
+# ----------------------------
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "avg_seconds": round(self.total / self.count, 6) if self.count else 0.0,
+            "max_seconds": round(self.max, 6),
+        }
+
+
+class PoolStats:
+    def __init__(self):
+        self.wait = _Timing()
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.held_by_route: Dict[str, _Timing] = {}
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long callers wait to get a connection."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            pool_stats.timeouts += 1
+            print(f"DB pool timeout on {current_route()}: {self.status()}")
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            pool_stats.wait.add(waited)
+            if waited >= DB_POOL_SLOW_CHECKOUT_SECONDS:
+                pool_stats.slow_checkouts += 1
+                print(f"Slow DB pool checkout ({waited:.3f}s) on {current_route()}: {self.status()}")
+
+
+def instrument_engine(engine) -> None:
+    """Track, per route, how long each checked-out connection is held."""
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        connection_record.info["route"] = current_route()
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        route = connection_record.info.pop("route", "background")
+        if checked_out_at is not None:
+            timing = pool_stats.held_by_route.setdefault(route, _Timing())
+            timing.add(time.perf_counter() - checked_out_at)
+
+
+def pool_snapshot(engine) -> dict:
+    pool = engine.sync_engine.pool
+    routes: List[dict] = [
+        {"route": route, **timing.as_dict()}
+        for route, timing in sorted(pool_stats.held_by_route.items(), key=lambda item: -item[1].total)
+    ]
+    return {
+        "size": pool.size() if hasattr(pool, "size") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "checkout_wait": pool_stats.wait.as_dict(),
+        "timeouts": pool_stats.timeouts,
+        "slow_checkouts": pool_stats.slow_checkouts,
+        "checkout_duration_by_route": routes,
+    }
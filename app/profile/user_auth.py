@@ -1,15 +1,15 @@
-from fastapi import APIRouter, Header, Depends, status, HTTPException, UploadFile, File
+from fastapi import APIRouter, Header, Depends, status, HTTPException, UploadFile, File, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-import asyncio
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
 import jwt
-import re
 import uuid
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
-from passlib.hash import pbkdf2_sha256
-import random, string
-from app.models import User, UserProfile, UserAddress, RewardHistory, UserReferral, PointsActionType
+import secrets
+import string
+from app.models import User, UserProfile, UserAddress, UserReferral, PointsActionType
 from app.schemas import (
     ContactInfo, 
     RegisterFinal, 
@@ -19,15 +19,24 @@ from app.schemas import (
     AddressCreate,
     AddressOut
 )
-from app.otp_utils import generate_otp_secret, generate_otp, verify_otp
-from app.email_utils import send_email
+from app.otp_utils import otp_service, OTPRateLimited
+from app.contact_utils import Contact, classify_contact, normalize_phone, user_contact_filter
+from app.email_utils import queue_email
 from app.database import get_db 
-from app.config import AUTHORIZATION_KEY, SECRET_KEY, ALGORITHM
+from app.cache_utils import TTLCache
+from app.points_utils import record_reward
+from app.config import (
+    AUTHORIZATION_KEY, SECRET_KEY, ALGORITHM,
+    PRINCIPAL_CACHE_TTL_SECONDS, PRINCIPAL_CACHE_MAX_SIZE,
+)
 
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# JWT subject (email) -> (User columns, UserProfile columns)
+principal_cache = TTLCache(max_size=PRINCIPAL_CACHE_MAX_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
 router = APIRouter(
     prefix="/auth",
     tags=["Authentication"]
@@ -37,13 +46,19 @@ router = APIRouter(
 def generate_referral_code():
     return str(uuid.uuid4())[:8].upper()
 
-def is_email(contact: str) -> bool:
-    return bool(re.match(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$', contact))
+def parse_contact(raw: str) -> Contact:
+    contact = classify_contact(raw)
+    if contact is None:
+        raise HTTPException(status_code=422, detail="Enter a valid email address or phone number.")
+    return contact
 
-def generate_random_string(length_min=8, length_max=10):
-    length = random.randint(length_min, length_max)
-    raw_password = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-    return pbkdf2_sha256.hash(raw_password)
+# Django's UNUSABLE_PASSWORD_PREFIX: no password ever matches, so OTP-only accounts need no KDF work
+UNUSABLE_PASSWORD_PREFIX = "!"
+UNUSABLE_PASSWORD_SUFFIX_LENGTH = 40
+
+def make_unusable_password() -> str:
+    alphabet = string.ascii_letters + string.digits
+    return UNUSABLE_PASSWORD_PREFIX + "".join(secrets.choice(alphabet) for _ in range(UNUSABLE_PASSWORD_SUFFIX_LENGTH))
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -56,40 +71,56 @@ def check_authorization_key(authorization_key: str = Header(...)):
         raise HTTPException(status_code=401, detail="Invalid authorization key")
     return authorization_key
 
-@router.post("/request-otp", status_code=status.HTTP_200_OK)
-async def request_registration_otp(data: ContactInfo, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
-    if is_email(data.contact):
-        query = select(User).where(User.email == data.contact)
+async def issue_otp(purpose: str, contact: str, request: Request) -> str:
+    client_ip = request.client.host if request.client else None
+    try:
+        return await otp_service.issue(purpose, contact, client_ip)
+    except OTPRateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many code requests. Please try again later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+def send_otp(contact: Contact, subject: str, otp: str) -> None:
+    if contact.is_email:
+        if not queue_email(contact.value, subject, f"Your code is: {otp}"):
+            raise HTTPException(status_code=503, detail="Unable to send the code right now. Please try again shortly.")
     else:
-        query = select(User).where(User.phone_number == data.contact)
+        print(f"SMS to {contact.value}: Your code is {otp}")
 
-    existing_user = await db.execute(query)
-    if existing_user.scalars().first():
+@router.post("/request-otp", status_code=status.HTTP_200_OK)
+async def request_registration_otp(data: ContactInfo, request: Request, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
+    contact = parse_contact(data.contact)
+    existing_user = await db.execute(select(User.id).where(user_contact_filter(contact)))
+    if existing_user.first():
         raise HTTPException(status_code=409, detail="An account with this contact info already exists.")
 
-    otp_secret = generate_otp_secret()
-    otp = generate_otp(otp_secret)
-
-    if is_email(data.contact):
-        asyncio.create_task(send_email(data.contact, "Your Registration Code", f"Your code is: {otp}"))
-    else:
-        print(f"SMS to {data.contact}: Your code is {otp}")
-    return {"otp_token": otp_secret, "message": "OTP sent."}
+    otp = await issue_otp("register", contact.value, request)
+    send_otp(contact, "Your Registration Code", otp)
+    return {"otp_token": await otp_service.bind("register", contact.value), "message": "OTP sent."}
 
 @router.post("/register", response_model=UserProfileOut)
 async def register_user(data: RegisterFinal, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
-    if not verify_otp(data.otp_token, data.otp):
+    email = classify_contact(data.email)
+    phone_e164 = normalize_phone(data.phone_number)
+    if email is None or phone_e164 is None:
+        raise HTTPException(status_code=422, detail="Enter a valid email address and phone number.")
+
+    # otp_token names the contact the code was sent to; it must be one of the two being registered
+    issued_to = await otp_service.bound_contact("register", data.otp_token)
+    if issued_to not in (email.value, phone_e164) or not await otp_service.verify("register", issued_to, data.otp):
         raise HTTPException(status_code=401, detail="Invalid or expired OTP.")
 
-    result = await db.execute(select(User).where(User.email == data.email))
-    existing_user = result.scalars().first()
-    if existing_user:
+    result = await db.execute(select(User.id).where(user_contact_filter(email)))
+    if result.first():
         raise HTTPException(status_code=400, detail="Email already registered.")
     new_user = User(
-        email=data.email,
+        email=email.value,
         phone_country_code='+91',
         phone_number=data.phone_number,
-        password=generate_random_string(),
+        phone_e164=phone_e164,
+        password=make_unusable_password(),
         user_type='user',
         created_at=datetime.now(),
         updated_at=datetime.now(),
@@ -104,7 +135,6 @@ async def register_user(data: RegisterFinal, db: AsyncSession = Depends(get_db),
         last_name=data.last_name,
         age=data.age,
         gender=data.gender,
-        otp=data.otp_token,
         referral_code=generate_referral_code()
     )
     db.add(user_profile)
@@ -128,13 +158,7 @@ async def register_user(data: RegisterFinal, db: AsyncSession = Depends(get_db),
             )
             referral_action = action_type_query.scalars().first()
             if referral_action:
-                reward = RewardHistory(
-                    user_id=referrer_profile.user_id,
-                    action_type_id=referral_action.id,
-                    points=50,
-                    timestamp=datetime.now()
-                )
-                db.add(reward)
+                await record_reward(db, referrer_profile.user_id, referral_action.id, points=50)
             
     await db.commit()
     await db.refresh(user_profile)
@@ -149,59 +173,30 @@ async def register_user(data: RegisterFinal, db: AsyncSession = Depends(get_db),
     }
 
 @router.post("/login/request-otp", status_code=status.HTTP_200_OK)
-async def request_login_otp(data: ContactInfo, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
-    if is_email(data.contact):
-        query = select(User.id, User.email, User.phone_number, User.is_active).where(User.email == data.contact)
-    else:
-        query = select(User.id, User.email, User.phone_number, User.is_active).where(User.phone_number == data.contact)
-
-    result = await db.execute(query)
+async def request_login_otp(data: ContactInfo, request: Request, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
+    contact = parse_contact(data.contact)
+    result = await db.execute(select(User.is_active).where(user_contact_filter(contact)))
     user = result.mappings().first()
 
     if not user or not user['is_active']:
         raise HTTPException(status_code=403, detail="User account is inactive. Please contact support.")
 
-    otp_secret = generate_otp_secret()
-    otp = generate_otp(otp_secret)
-    
-    profile_query = select(UserProfile).where(UserProfile.user_id == user["id"])
-    profile_result = await db.execute(profile_query)
-    profile = profile_result.scalars().first()
-
-    if not profile:
-        raise HTTPException(status_code=404, detail="User profile not found.")
-
-    profile.otp = otp_secret
-    db.add(profile)
-    await db.commit()
-    await db.refresh(profile)
-    
-    if is_email(user.email):
-        asyncio.create_task(send_email(user.email, "Your Login Code", f"Your code is: {otp}"))
-    else:
-        print(f"SMS to {user.phone_number}: Your code is {otp}")
+    otp = await issue_otp("login", contact.value, request)
+    send_otp(contact, "Your Login Code", otp)
     return {"message": "OTP sent."}
 
 
 @router.post("/login/verify", response_model=Token)
 async def verify_login_and_get_token(data: VerifyLoginOTP, db: AsyncSession = Depends(get_db), _auth=Depends(check_authorization_key)):
-    if is_email(data.contact):
-        query = select(User).where(User.email == data.contact)
-    else:
-        query = select(User).where(User.phone_number == data.contact)
-
-    result = await db.execute(query)
-    user = result.scalars().first()
-    profile_query = select(UserProfile).where(UserProfile.user_id == user.id)
-    profile_result = await db.execute(profile_query)
-    profile = profile_result.scalars().first()
-    if not profile:
-        raise HTTPException(status_code=404, detail="User profile not found")
+    contact = classify_contact(data.contact)
+    if contact is None or not await otp_service.verify("login", contact.value, data.otp):
+        raise HTTPException(status_code=401, detail="Invalid contact or OTP.")
 
-    if not user or not verify_otp(profile.otp, data.otp):
+    email = (await db.execute(select(User.email).where(user_contact_filter(contact)))).scalar()
+    if not email:
         raise HTTPException(status_code=401, detail="Invalid contact or OTP.")
 
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
@@ -214,19 +209,41 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Dep
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     return email
 
+def _column_snapshot(obj) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in sa_inspect(obj).mapper.column_attrs}
+
+async def _attach_snapshot(db: AsyncSession, model, snapshot: dict):
+    """Rebuild a persistent instance from cached column values without issuing SQL."""
+    obj = model(**snapshot)
+    make_transient_to_detached(obj)
+    return await db.merge(obj, load=False)
+
+def invalidate_principal(*emails: str) -> None:
+    """Drop cached principals after a write to the User or UserProfile columns they snapshot."""
+    for email in emails:
+        if email:
+            principal_cache.delete(email)
+
 async def get_current_user_object(current_user_email: str = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    query = select(User).where(User.email == current_user_email)
-    result = await db.execute(query)
-    user = result.scalars().first()
-    if not user:
+    cached = principal_cache.get(current_user_email)
+    if cached:
+        user_snapshot, profile_snapshot = cached
+        user = await _attach_snapshot(db, User, user_snapshot)
+        profile = await _attach_snapshot(db, UserProfile, profile_snapshot)
+        return user, profile
+
+    query = (
+        select(User, UserProfile)
+        .outerjoin(UserProfile, UserProfile.user_id == User.id)
+        .where(User.email == current_user_email)
+    )
+    row = (await db.execute(query)).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    # Get UserProfile by user_id
-    profile_query = select(UserProfile).where(UserProfile.user_id == user.id)
-    profile_result = await db.execute(profile_query)
-    profile = profile_result.scalars().first()
-    print(user, profile)
+    user, profile = row
     if not profile:
         raise HTTPException(status_code=404, detail="User profile not found")
+    principal_cache.set(current_user_email, (_column_snapshot(user), _column_snapshot(profile)))
     return user, profile
 
 @router.post("/add-address", response_model=AddressOut, status_code=201)
@@ -2,15 +2,27 @@ import os
 import asyncio
 from app.database import get_db
 from app.schemas import UserProfileOut, UserProfileUpdate
-from app.profile.user_auth import get_current_user_object, check_authorization_key
+from app.profile.user_auth import get_current_user_object, check_authorization_key, invalidate_principal
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends, UploadFile, File
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from app.file_utils import save_profile_photo, photo_thumbnails
+from app.storage_utils import retain_blob, release_blob
+from app.contact_utils import normalize_phone
 
 router = APIRouter(
     prefix="/profile",
     tags=["User Profile"]
 )
 
+
+async def _release_photo(db: AsyncSession, photo_path: str) -> None:
+    """Drop the profile's reference to its photo; photos saved before the blob store are deleted directly."""
+    if await release_blob(db, photo_path):
+        return
+    file_path = photo_path.replace("/static/", "app/static/")
+    if await asyncio.to_thread(os.path.exists, file_path):
+        await asyncio.to_thread(os.remove, file_path)
+
 # GET /profile/account_details
 @router.get("/account_details", response_model=UserProfileOut)
 async def get_my_profile(
@@ -27,6 +39,7 @@ async def get_my_profile(
         gender=profile.gender,
         pan_number=profile.pan_number,
         profile_photo_path=profile.profile_photo_path,
+        profile_photo_thumbnails=photo_thumbnails(profile.profile_photo_path),
         referral_code=profile.referral_code,
         email=user.email
     )
@@ -40,7 +53,15 @@ async def update_profile(
     _auth=Depends(check_authorization_key)
 ):
     user, profile = current_user
+    previous_email = user.email
     update_dict = profile_data.model_dump(exclude_unset=True)
+    if 'phone' in update_dict:
+        # UserProfileUpdate calls it `phone`; the column is phone_number
+        update_dict['phone_number'] = update_dict.pop('phone')
+    if update_dict.get('phone_number'):
+        phone_e164 = normalize_phone(update_dict['phone_number'], user.phone_country_code)
+        if phone_e164 is None:
+            raise HTTPException(status_code=422, detail="Enter a valid phone number.")
     
     profile_fields = ['first_name', 'last_name', 'gender', 'pan_number', 'age']
     for field in profile_fields:
@@ -52,10 +73,13 @@ async def update_profile(
     for field in user_fields:
         if field in update_dict:
             setattr(user, field, update_dict[field])
+    if 'phone_number' in update_dict:
+        user.phone_e164 = phone_e164 if user.phone_number else None
             
     await db.commit()
     await db.refresh(profile)
     await db.refresh(user)
+    invalidate_principal(previous_email, user.email)
 
     return UserProfileOut(
         id=user.id,
@@ -65,6 +89,7 @@ async def update_profile(
         gender=profile.gender,
         pan_number=profile.pan_number,
         profile_photo_path=profile.profile_photo_path,
+        profile_photo_thumbnails=photo_thumbnails(profile.profile_photo_path),
         referral_code=profile.referral_code,
         email=user.email
     )
@@ -78,16 +103,15 @@ async def upload_photo(
     _auth=Depends(check_authorization_key)
 ):
     user, profile = current_user
-    upload_dir = "app/static/profile_photos"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, f"user_{user.id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    
-    profile.profile_photo_path = f"/static/profile_photos/user_{user.id}_{file.filename}"
+    photo_url = await save_profile_photo(file)
+    await retain_blob(db, photo_url)
+    if profile.profile_photo_path:
+        await _release_photo(db, profile.profile_photo_path)
+    profile.profile_photo_path = photo_url
     await db.commit()
     await db.refresh(profile)
     await db.refresh(user)
+    invalidate_principal(user.email)
     return UserProfileOut(
         id=user.id,
         first_name=profile.first_name,
@@ -96,6 +120,7 @@ async def upload_photo(
         gender=profile.gender,
         pan_number=profile.pan_number,
         profile_photo_path=profile.profile_photo_path,
+        profile_photo_thumbnails=photo_thumbnails(profile.profile_photo_path),
         referral_code=profile.referral_code,
         email=user.email
     )
@@ -110,11 +135,11 @@ async def remove_photo(
     # Remove photo file from disk if exists
     user, profile = current_user
     if profile.profile_photo_path:
-        file_path = profile.profile_photo_path.replace("/static/", "app/static/")
-        if await asyncio.to_thread(os.path.exists, file_path):
-            await asyncio.to_thread(os.remove, file_path)
+        await _release_photo(db, profile.profile_photo_path)
         profile.profile_photo_path = None
+        email = user.email
         await db.commit()
+        invalidate_principal(email)
         await db.refresh(profile)
     return UserProfileOut(
         id=user.id,
@@ -124,6 +149,7 @@ async def remove_photo(
         gender=profile.gender,
         pan_number=profile.pan_number,
         profile_photo_path=profile.profile_photo_path,
+        profile_photo_thumbnails=photo_thumbnails(profile.profile_photo_path),
         referral_code=profile.referral_code,
         email=user.email
     )
@@ -137,20 +163,15 @@ async def update_photo(
     _auth=Depends(check_authorization_key)
 ):
     user, profile = current_user
-    upload_dir = "app/static/profile_photos"
-    os.makedirs(upload_dir, exist_ok=True)
+    photo_url = await save_profile_photo(file)
+    await retain_blob(db, photo_url)
     if profile.profile_photo_path:
-        old_file_path = profile.profile_photo_path.replace("/static/", "app/static/")
-        if await asyncio.to_thread(os.path.exists, old_file_path):
-            await asyncio.to_thread(os.remove, old_file_path)
-    new_file_path = os.path.join(upload_dir, f"user_{user.id}_{file.filename}")
-    
-    with open(new_file_path, "wb") as f:
-        f.write(await file.read())
-    profile.profile_photo_path = f"/static/profile_photos/user_{user.id}_{file.filename}"
+        await _release_photo(db, profile.profile_photo_path)
+    profile.profile_photo_path = photo_url
     await db.commit()
     await db.refresh(profile)
     await db.refresh(user)
+    invalidate_principal(user.email)
     return UserProfileOut(
         id=user.id,
         first_name=profile.first_name,
@@ -159,6 +180,7 @@ async def update_photo(
         gender=profile.gender,
         pan_number=profile.pan_number,
         profile_photo_path=profile.profile_photo_path,
+        profile_photo_thumbnails=photo_thumbnails(profile.profile_photo_path),
         referral_code=profile.referral_code,
         email=user.email
     )
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.profile.user_auth import get_current_user_object, check_authorization_key
+from app.profile.user_auth import get_current_user_object, check_authorization_key, invalidate_principal
 from app.schemas import NotificationSettingsOut, NotificationSettingsUpdate
 from app.models import SavedLocation, SearchHistory
 
@@ -73,6 +73,7 @@ async def update_notification(
     await db.commit()
     await db.refresh(user)
     await db.refresh(profile)
+    invalidate_principal(user.email)
 
     return NotificationSettingsOut(
         inapp_notifications=user.inapp_notifications,
@@ -101,7 +102,9 @@ async def delete_account(
 
     user.is_active = False
     db.add(user)
+    email = user.email
     await db.commit()
+    invalidate_principal(email)
     return {"message": "Account deactivated successfully."}
 
 
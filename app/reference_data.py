@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.database import SessionLocal
+from app.config import REFERENCE_DATA_TTL_SECONDS, REFERENCE_DATA_CLIENT_MAX_AGE
+from app.models import (
+    ConcernList, TopSellingCategory, CancelReason, BrandList,
+    HealthIssue, Specialization, PointsActionType, PointsBadge,
+    IssueType, PostType,
+)
+from app.schemas import PointsActionTypeOut, PointsBadgeOut, IssueTypeOut, PostTypeOut
+
+
+# ----------------------------
+# Cached tables
+# ----------------------------
+class ReferenceTable:
+    """Serialized snapshot of one lookup table plus its ETag."""
+
+    def __init__(self, name: str, loader: Callable[[AsyncSession], Awaitable[object]]):
+        self.name = name
+        self.loader = loader
+        self.payload: Optional[object] = None
+        self.body: bytes = b""
+        self.etag: Optional[str] = None
+        self.version = 0
+        self.expires_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_stale(self) -> bool:
+        return self.etag is None or time.monotonic() >= self.expires_at
+
+    async def refresh(self) -> None:
+        async with SessionLocal() as db:
+            payload = jsonable_encoder(await self.loader(db))
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if etag != self.etag:
+            self.version += 1
+        self.payload, self.body, self.etag = payload, body, etag
+        self.expires_at = time.monotonic() + REFERENCE_DATA_TTL_SECONDS
+
+    async def get(self) -> "ReferenceTable":
+        if self.is_stale:
+            async with self._lock:
+                if self.is_stale:
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        # Keep serving the previous snapshot if the reload fails
+                        if self.etag is None:
+                            raise
+                        print(f"Failed to refresh reference data '{self.name}': {e}")
+                        self.expires_at = time.monotonic() + REFERENCE_DATA_TTL_SECONDS
+        return self
+
+
+_tables: Dict[str, ReferenceTable] = {}
+
+
+def reference_table(name: str):
+    """Register a loader returning the JSON-serializable payload for `name`."""
+    def decorator(loader):
+        _tables[name] = ReferenceTable(name, loader)
+        return loader
+    return decorator
+
+
+# ----------------------------
+# Loaders
+# ----------------------------
+@reference_table("concern_list")
+async def _load_concern_list(db: AsyncSession):
+    rows = (await db.execute(ConcernList.__table__.select().order_by(ConcernList.id))).fetchall()
+    return [{"id": c.id, "category": c.category} for c in rows]
+
+
+@reference_table("top_selling_category")
+async def _load_top_selling_category(db: AsyncSession):
+    rows = (await db.execute(TopSellingCategory.__table__.select().order_by(TopSellingCategory.id))).fetchall()
+    return [{"id": c.id, "category": c.category} for c in rows]
+
+
+@reference_table("cancel_reason")
+async def _load_cancel_reason(db: AsyncSession):
+    rows = (await db.execute(CancelReason.__table__.select().order_by(CancelReason.id))).fetchall()
+    return [{"id": r.id, "reason": r.reason} for r in rows]
+
+
+@reference_table("brand_list")
+async def _load_brand_list(db: AsyncSession):
+    rows = (await db.execute(BrandList.__table__.select().order_by(BrandList.id))).fetchall()
+    return [{"id": b.id, "brand": b.name} for b in rows]
+
+
+@reference_table("appointment_dropdowns")
+async def _load_appointment_dropdowns(db: AsyncSession):
+    health_issues = (await db.execute(select(HealthIssue).order_by(HealthIssue.id))).scalars().all()
+    specializations = (await db.execute(select(Specialization).order_by(Specialization.id))).scalars().all()
+    return {
+        "health_issues": [{"id": h.id, "name": h.name} for h in health_issues],
+        "specializations": [{"id": s.id, "name": s.name} for s in specializations]
+    }
+
+
+@reference_table("points_actions")
+async def _load_points_actions(db: AsyncSession):
+    rows = (await db.execute(select(PointsActionType).order_by(PointsActionType.action_type.asc()))).scalars().all()
+    return [PointsActionTypeOut.model_validate(r) for r in rows]
+
+
+@reference_table("badge_list")
+async def _load_badge_list(db: AsyncSession):
+    rows = (await db.execute(select(PointsBadge).order_by(PointsBadge.min_points.asc()))).scalars().all()
+    return [PointsBadgeOut.model_validate(r) for r in rows]
+
+
+@reference_table("issue_type")
+async def _load_issue_type(db: AsyncSession):
+    rows = (await db.execute(select(IssueType).order_by(IssueType.id))).scalars().all()
+    return [IssueTypeOut.model_validate(r) for r in rows]
+
+
+@reference_table("post_types")
+async def _load_post_types(db: AsyncSession):
+    rows = (await db.execute(select(PostType).where(PostType.is_active == True).order_by(PostType.id))).scalars().all()
+    return [PostTypeOut.model_validate(r) for r in rows]
+
+
+# ----------------------------
+# Public API
+# ----------------------------
+async def load_reference_data() -> None:
+    """Warm every registered table; called once at startup."""
+    for table in _tables.values():
+        try:
+            await table.refresh()
+        except Exception as e:
+            print(f"Failed to load reference data '{table.name}': {e}")
+
+
+def invalidate_reference_data(name: Optional[str] = None) -> None:
+    """Force a reload on next access, e.g. after an admin edits a lookup table."""
+    for table in ([_tables[name]] if name else _tables.values()):
+        table.expires_at = float("-inf")
+
+
+async def get_reference_data(name: str) -> object:
+    return (await _tables[name].get()).payload
+
+
+async def get_reference_table(name: str) -> ReferenceTable:
+    """Like get_reference_data, but exposes `version` so callers can rebuild derived indexes."""
+    return await _tables[name].get()
+
+
+async def reference_response(request: Request, name: str) -> Response:
+    """Serve a cached table as JSON, answering 304 when the client's ETag is current."""
+    table = await _tables[name].get()
+    headers = {
+        "ETag": table.etag,
+        "Cache-Control": f"private, max-age={REFERENCE_DATA_CLIENT_MAX_AGE}",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in candidates or table.etag in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=table.body, media_type="application/json", headers=headers)
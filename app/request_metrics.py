@@ -0,0 +1,197 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from pymongo import monitoring
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from app.config import REQUEST_STATS_HEADER
+from app.pool_metrics import request_scope, current_route, pool_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ----------------------------
+# Per-request counters
+# ----------------------------
+class RequestStats:
+    """Database work done while serving one request."""
+    __slots__ = ("sql_count", "sql_seconds", "mongo_count", "mongo_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.mongo_count = 0
+        self.mongo_seconds = 0.0
+
+    def server_timing(self, total_seconds: float) -> str:
+        return (
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries", '
+            f'mongo;dur={self.mongo_seconds * 1000:.1f};desc="{self.mongo_count} commands", '
+            f"total;dur={total_seconds * 1000:.1f}"
+        )
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def instrument_sqlalchemy(engine) -> None:
+    """Count statements and their execution time against the current request."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info["query_started_at"].pop()
+        stats = request_stats.get()
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_seconds += time.perf_counter() - started_at
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Counts Mongo commands against the current request. Motor runs pymongo on
+    executor threads with a copy of the caller's context, so request_stats
+    still points at the right request here.
+    """
+
+    def _record(self, event) -> None:
+        stats = request_stats.get()
+        if stats is not None:
+            stats.mongo_count += 1
+            stats.mongo_seconds += event.duration_micros / 1_000_000
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+# ----------------------------
+# Per-route aggregates
+# ----------------------------
+class _RouteTotals:
+    __slots__ = ("requests", "duration", "buckets", "sql_count", "sql_seconds", "mongo_count", "mongo_seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.mongo_count = 0
+        self.mongo_seconds = 0.0
+
+    def add(self, seconds: float, stats: RequestStats) -> None:
+        self.requests += 1
+        self.duration += seconds
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+        self.sql_count += stats.sql_count
+        self.sql_seconds += stats.sql_seconds
+        self.mongo_count += stats.mongo_count
+        self.mongo_seconds += stats.mongo_seconds
+
+
+_route_totals: Dict[Tuple[str, str], _RouteTotals] = {}
+_status_counts: Dict[Tuple[str, str, int], int] = {}
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware: sets up request_scope / request_stats for the request,
+    records its totals by route template, and optionally reports them to the
+    client in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        scope_token = request_scope.set(scope)
+        stats_token = request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_stats(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if REQUEST_STATS_HEADER:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", stats.server_timing(time.perf_counter() - started)
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            key = (scope["method"], current_route())
+            _route_totals.setdefault(key, _RouteTotals()).add(time.perf_counter() - started, stats)
+            status_key = (*key, status)
+            _status_counts[status_key] = _status_counts.get(status_key, 0) + 1
+            request_stats.reset(stats_token)
+            request_scope.reset(scope_token)
+
+
+# ----------------------------
+# Prometheus text exposition
+# ----------------------------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_prometheus(engine) -> str:
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    metric("http_requests_total", "counter", "Requests served, by route template and status.")
+    for (method, route, status), count in sorted(_status_counts.items()):
+        lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    metric("http_request_duration_seconds", "histogram", "Time from request start to response end.")
+    for (method, route), totals in sorted(_route_totals.items()):
+        for bound, count in zip(DURATION_BUCKETS, totals.buckets):
+            lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+        lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le='+Inf')} {totals.requests}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {totals.duration:.6f}")
+        lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} {totals.requests}")
+
+    per_route = (
+        ("db_queries_total", "counter", "SQL statements executed.", "sql_count"),
+        ("db_query_seconds_total", "counter", "Time spent executing SQL.", "sql_seconds"),
+        ("mongo_commands_total", "counter", "Mongo commands executed.", "mongo_count"),
+        ("mongo_command_seconds_total", "counter", "Time spent in Mongo commands.", "mongo_seconds"),
+    )
+    for name, kind, help_text, attribute in per_route:
+        metric(name, kind, help_text)
+        for (method, route), totals in sorted(_route_totals.items()):
+            lines.append(f"{name}{_labels(method=method, route=route)} {getattr(totals, attribute)}")
+
+    pool = engine.sync_engine.pool
+    metric("db_pool_checked_out", "gauge", "Connections currently checked out.")
+    lines.append(f"db_pool_checked_out {pool.checkedout()}")
+    metric("db_pool_checkout_wait_seconds", "summary", "Time spent waiting for a pooled connection.")
+    lines.append(f"db_pool_checkout_wait_seconds_sum {pool_stats.wait.total:.6f}")
+    lines.append(f"db_pool_checkout_wait_seconds_count {pool_stats.wait.count}")
+    metric("db_pool_timeouts_total", "counter", "Checkouts that hit the pool timeout.")
+    lines.append(f"db_pool_timeouts_total {pool_stats.timeouts}")
+    return "\n".join(lines) + "\n"
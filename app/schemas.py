@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr, ConfigDict, Field
 from typing import Optional
 from datetime import datetime, date, time
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Dict
 from decimal import Decimal
 
 class Token(BaseModel):
@@ -17,7 +17,7 @@ class RegisterFinal(BaseModel):
     email: EmailStr
     phone_number: str
     otp: str
-    otp_token: str 
+    otp_token: str  # returned by /auth/request-otp; names the contact the code was sent to
     referral_code: Optional[str] = None
     gender: Optional[str] = None
     age: Optional[int] = None    
@@ -30,6 +30,7 @@ class UserProfileOut(BaseModel):
     gender: Optional[str] = None
     pan_number: Optional[str] = None
     profile_photo_path: Optional[str] = None
+    profile_photo_thumbnails: Dict[str, str] = {}
     referral_code: Optional[str] = None
     email: EmailStr
     class Config:
@@ -416,6 +417,12 @@ class RewardHistoryResponse(BaseModel):
     total_points: int
     filtered_total_points: int 
 
+class MyBadgeOut(BaseModel):
+    total_points: int
+    badge: Optional[PointsBadgeOut] = None
+    next_badge: Optional[PointsBadgeOut] = None
+    points_to_next_badge: Optional[int] = None
+
 # --------------------------------------------
 # Doctors
 # --------------------------------------------
@@ -534,6 +541,7 @@ class WalletBalanceOut(BaseModel):
 class WalletHistoryOut(BaseModel):
     transactions: List[WalletTransactionOut]
     total: int
+    next_cursor: Optional[str] = None
 
 # --------------------------------------------
 # Appointments
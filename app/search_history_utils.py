@@ -0,0 +1,92 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from app.database import mongo_db
+from app.config import SEARCH_HISTORY_BATCH_SIZE, SEARCH_HISTORY_FLUSH_INTERVAL_SECONDS
+
+HISTORY_LENGTH = 20  # keep only last 20 searches per user
+MAX_BUFFERED_ENTRIES = 50_000
+
+
+# ----------------------------
+# Buffered search-history writer
+# ----------------------------
+class SearchHistoryWriter:
+    """
+    Collects search-history entries in memory and writes them to Mongo with one
+    bulk_write per flush, so the search endpoint never waits on the history write.
+    A flush runs when `batch_size` entries are buffered or every `flush_interval` seconds.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, batch_size: int, flush_interval: float):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer: List[Tuple[str, dict]] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, name: str) -> None:
+        if len(self._buffer) >= MAX_BUFFERED_ENTRIES:
+            self.dropped += 1
+            return
+        self._buffer.append((user_id, {"name": name, "searched_at": datetime.now()}))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        pending, self._buffer = self._buffer, []
+
+        # One $push per user, preserving search order within the batch
+        per_user: "OrderedDict[str, List[dict]]" = OrderedDict()
+        for user_id, entry in pending:
+            per_user.setdefault(user_id, []).append(entry)
+        operations = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$push": {"history": {"$each": entries, "$slice": -HISTORY_LENGTH}}},
+                upsert=True,
+            )
+            for user_id, entries in per_user.items()
+        ]
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            print(f"Failed to write {len(pending)} search history entries: {e}")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background loop and drain whatever is still buffered."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+search_history_writer = SearchHistoryWriter(
+    mongo_db["search_history"],
+    batch_size=SEARCH_HISTORY_BATCH_SIZE,
+    flush_interval=SEARCH_HISTORY_FLUSH_INTERVAL_SECONDS,
+)
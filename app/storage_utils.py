@@ -0,0 +1,424 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+from fastapi import UploadFile
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import MEDIA_ROOT, UPLOAD_IO_WORKERS, VIRUS_SCAN_ENABLED
+from app.database import SessionLocal
+from app.models import StorageBlob
+from app.virus_scan import ScanResult, StreamScan, scan_cache, scan_file
+
+# ----------------------------
+# Global constants
+# ----------------------------
+BLOB_PREFIX = "blobs/"
+PHOTO_PREFIX = "photos/"  # public, served from /media/photos
+BLOB_NAMESPACES = (BLOB_PREFIX, PHOTO_PREFIX)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+BLOB_GC_GRACE_SECONDS = 3600
+BLOB_GC_BATCH_SIZE = 500
+UPLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 5 * 1024 * 1024  # 5 MB
+
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_IO_WORKERS, thread_name_prefix="upload-io")
+
+
+# Leading bytes -> canonical extension, so identical content always gets one blob path
+FILE_SIGNATURES = (
+    (b"%PDF-", ".pdf"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+)
+EXTENSION_ALIASES = {".jpeg": ".jpg"}
+
+
+def detect_extension(head: bytes, declared: str) -> str:
+    """Extension for stored content: from its signature when known, else the normalized declared one."""
+    for signature, ext in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    declared = declared.lower()
+    return EXTENSION_ALIASES.get(declared, declared)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InfectedUpload(Exception):
+    def __init__(self, signature: Optional[str]):
+        super().__init__(signature)
+        self.signature = signature
+
+
+class StoredBlob(NamedTuple):
+    path: str  # relative to MEDIA_ROOT, e.g. "blobs/ab/cd/abcd....pdf"
+    sha256: str
+    size: int
+    created: bool  # False when identical content was already stored
+
+
+async def run_io(func, *args):
+    """Run blocking file I/O on the bounded upload thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_upload_executor, func, *args)
+
+
+# ----------------------------
+# Streaming uploads
+# ----------------------------
+async def hash_upload(file_obj: UploadFile, max_size: int = DEFAULT_MAX_SIZE) -> Tuple[int, str, bytes]:
+    """
+    Read an upload once to get (size, sha256, first bytes) without writing it
+    anywhere, then rewind it.
+    """
+    if file_obj.size is not None and file_obj.size > max_size:
+        raise UploadTooLarge()
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    await file_obj.seek(0)
+    while chunk := await file_obj.read(UPLOAD_CHUNK_SIZE):
+        if not head:
+            head = chunk[:16]
+        size += len(chunk)
+        if size > max_size:
+            raise UploadTooLarge()
+        digest.update(chunk)
+    await file_obj.seek(0)
+    return size, digest.hexdigest(), head
+
+
+async def stream_upload(
+    file_obj: UploadFile,
+    destination: Path,
+    max_size: int = DEFAULT_MAX_SIZE,
+    scan: Optional[StreamScan] = None,
+) -> Tuple[int, str]:
+    """
+    Stream an upload to `destination` in chunks, writing through the upload thread
+    pool so the event loop never blocks on disk. Returns (size, sha256 hexdigest).
+    Raises UploadTooLarge as soon as more than `max_size` bytes have been read;
+    nothing is left on disk in that case or on any other failure.
+    If `scan` is given, each chunk is sent to clamd while it is being written.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await run_io(open, destination, "wb")
+    try:
+        while chunk := await file_obj.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge()
+            digest.update(chunk)
+            if scan is not None:
+                await asyncio.gather(run_io(buffer.write, chunk), scan.feed(chunk))
+            else:
+                await run_io(buffer.write, chunk)
+        await run_io(buffer.close)
+    except BaseException:
+        if scan is not None:
+            scan.abort()
+        await run_io(buffer.close)
+        await run_io(lambda: destination.unlink(missing_ok=True))
+        raise
+    return size, digest.hexdigest()
+
+
+# ----------------------------
+# Content-addressed blob store
+# ----------------------------
+def blob_path(sha256: str, ext: str, namespace: str = BLOB_PREFIX) -> str:
+    return f"{namespace}{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def _touch(path: Path) -> bool:
+    """
+    Mark an existing blob as just used, so garbage collection leaves it alone for
+    another grace period. False if the file is gone (or being collected right now).
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def derived_path(path: str, suffix: str) -> str:
+    """Path of a file derived from a blob (e.g. a thumbnail); it lives and dies with the blob."""
+    stem, dot, ext = path.rpartition(".")
+    return f"{stem}_{suffix}{dot}{ext}"
+
+
+def blob_key(stored_path: Optional[str]) -> Optional[str]:
+    """
+    Recover the blob path from a stored value: a bare blob path, a /media/ URL or
+    a path under MEDIA_ROOT. None for anything else, e.g. legacy /static/ files.
+    """
+    if not stored_path:
+        return None
+    for root in ("", "/media/", f"{MEDIA_ROOT.as_posix()}/"):
+        if stored_path.startswith(root) and stored_path[len(root):].startswith(BLOB_NAMESPACES):
+            return stored_path[len(root):]
+    return None
+
+
+def public_url(path: str) -> str:
+    """URL of a blob in the public photo namespace."""
+    return f"/media/{path}"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-addressed files: a name never changes content, so cache forever."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+async def blob_scan_status(path: str) -> Optional[str]:
+    async with SessionLocal() as db:
+        return (await db.execute(select(StorageBlob.scan_status).where(StorageBlob.path == path))).scalar()
+
+
+async def record_scan(path: str, result: Optional[ScanResult]) -> None:
+    """
+    Save clamd's verdict on a blob (no-op when there is none). The row is created
+    at ref_count 0 if no request has retained the blob yet.
+    """
+    if result is None:
+        return
+    status = "clean" if result.clean else "infected"
+    async with SessionLocal() as db:
+        await db.execute(
+            insert(StorageBlob)
+            .values(path=path, ref_count=0, scan_status=status)
+            .on_conflict_do_update(index_elements=[StorageBlob.path], set_={"scan_status": status})
+        )
+        await db.commit()
+
+
+async def _check_existing(path: str) -> None:
+    """
+    Make sure a deduplicated blob was scanned before handing it to another uploader:
+    content stored while scanning was off or clamd was down is scanned now.
+    """
+    status = await blob_scan_status(path)
+    if status == "clean":
+        return
+    if status == "infected":
+        raise InfectedUpload(None)
+    result = await scan_file(MEDIA_ROOT / path)  # uses scan_cache for known content
+    await record_scan(path, result)
+    if result is not None and not result.clean:
+        raise InfectedUpload(result.signature)
+
+
+async def store_upload(file_obj: UploadFile, ext: str, max_size: int = DEFAULT_MAX_SIZE) -> StoredBlob:
+    """
+    Store an upload by content hash and detected format. If identical content is
+    already on disk this is only a hash pass (plus a scan if that content never
+    had one); otherwise the bytes are written (and virus-scanned while writing)
+    to a temporary file that is renamed into place once clean.
+    Callers must retain_blob() in the transaction that saves the returned path.
+    """
+    size, sha256, head = await hash_upload(file_obj, max_size)
+    path = blob_path(sha256, detect_extension(head, ext))
+    destination = MEDIA_ROOT / path
+    if await run_io(_touch, destination):
+        if VIRUS_SCAN_ENABLED:
+            await _check_existing(path)
+        return StoredBlob(path, sha256, size, False)
+
+    result = scan_cache.get(sha256) if VIRUS_SCAN_ENABLED else None
+    if result is not None and not result.clean:
+        raise InfectedUpload(result.signature)
+    scan = StreamScan() if VIRUS_SCAN_ENABLED and result is None else None
+
+    await run_io(lambda: destination.parent.mkdir(parents=True, exist_ok=True))
+    partial = destination.with_name(f"{destination.name}.{uuid.uuid4().hex}.part")
+    await stream_upload(file_obj, partial, max_size, scan=scan)
+    if scan is not None:
+        result = await scan.finish(sha256)
+        if result is not None and not result.clean:
+            await run_io(lambda: partial.unlink(missing_ok=True))
+            raise InfectedUpload(result.signature)
+    await run_io(os.replace, partial, destination)
+    await record_scan(path, result)
+    return StoredBlob(path, sha256, size, True)
+
+
+def _write_atomic(destination: Path, data: bytes) -> None:
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_name(f"{destination.name}.{uuid.uuid4().hex}.part")
+    partial.write_bytes(data)
+    os.replace(partial, destination)
+
+
+async def store_bytes(data: bytes, ext: str, namespace: str = BLOB_PREFIX) -> StoredBlob:
+    """store_upload for content already in memory, e.g. a re-encoded image."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = blob_path(sha256, detect_extension(data[:16], ext), namespace)
+    destination = MEDIA_ROOT / path
+    if await run_io(_touch, destination):
+        return StoredBlob(path, sha256, len(data), False)
+    await run_io(_write_atomic, destination, data)
+    return StoredBlob(path, sha256, len(data), True)
+
+
+async def store_derived(path: str, suffix: str, data: bytes) -> str:
+    """Write a file derived from blob `path` unless it already exists; returns its path."""
+    derived = derived_path(path, suffix)
+    destination = MEDIA_ROOT / derived
+    if not await run_io(destination.exists):
+        await run_io(_write_atomic, destination, data)
+    return derived
+
+
+async def retain_blob(db: AsyncSession, stored_path: Optional[str]) -> None:
+    """Count one more reference to a blob; no-op for paths outside the blob store."""
+    path = blob_key(stored_path)
+    if not path:
+        return
+    statement = insert(StorageBlob).values(path=path, ref_count=1)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[StorageBlob.path],
+        set_={"ref_count": StorageBlob.ref_count + 1, "updated_at": datetime.now()},
+    ))
+
+
+async def release_blob(db: AsyncSession, stored_path: Optional[str]) -> bool:
+    """
+    Drop one reference to a blob. The file itself is removed later by
+    collect_garbage, so a rollback never leaves a row pointing at nothing.
+    Returns False for paths outside the blob store.
+    """
+    path = blob_key(stored_path)
+    if not path:
+        return False
+    await db.execute(
+        update(StorageBlob)
+        .where(StorageBlob.path == path, StorageBlob.ref_count > 0)
+        .values(ref_count=StorageBlob.ref_count - 1)
+    )
+    return True
+
+
+def _base_path(file: Path) -> str:
+    """Blob path a stored file belongs to: itself, or its source blob for derived files."""
+    relative = file.relative_to(MEDIA_ROOT)
+    return str(relative.with_name(relative.stem.split("_", 1)[0] + relative.suffix))
+
+
+def _orphan_files(known: set, cutoff: float) -> List[str]:
+    """
+    Blob paths on disk that have no storage_blob row. Leftovers that cannot be
+    deduplicated into (partial writes, interrupted collections, derived files
+    whose blob is gone) are deleted straight away.
+    """
+    orphans = []
+    for namespace in BLOB_NAMESPACES:
+        root = MEDIA_ROOT / namespace
+        if not root.exists():
+            continue
+        for file in root.glob("*/*/*"):
+            if not file.is_file() or file.stat().st_mtime >= cutoff:
+                continue
+            if file.name.endswith((".part", ".gc")):
+                file.unlink(missing_ok=True)
+                continue
+            base = _base_path(file)
+            if base in known:
+                continue
+            if base == str(file.relative_to(MEDIA_ROOT)):
+                orphans.append(base)
+            elif not (MEDIA_ROOT / base).exists():
+                file.unlink(missing_ok=True)
+    return orphans
+
+
+def _remove_if_stale(path: str, cutoff: float) -> bool:
+    """
+    Delete a blob and its derived files unless it was touched after `cutoff`.
+    The blob is first renamed away, so a concurrent store_upload either touched it
+    before the rename (and the fresh mtime saves it) or finds it missing and
+    writes it again; either way it never returns a path that is then deleted.
+    """
+    blob = MEDIA_ROOT / path
+    tombstone = blob.with_name(f"{blob.name}.{uuid.uuid4().hex}.gc")
+    try:
+        os.rename(blob, tombstone)
+    except FileNotFoundError:
+        return True
+    if tombstone.stat().st_mtime >= cutoff:
+        os.replace(tombstone, blob)
+        return False
+    for derived in blob.parent.glob(f"{blob.stem}_*{blob.suffix}"):
+        derived.unlink(missing_ok=True)
+    tombstone.unlink(missing_ok=True)
+    return True
+
+
+async def collect_garbage(grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> int:
+    """
+    Delete blobs nobody references any more: rows at ref_count 0 and files that
+    never got a row (e.g. the request failed after storing). Anything referenced,
+    written or deduplicated within the grace period is left alone.
+
+    Rows are locked while their file is removed, so a concurrent retain_blob
+    either commits first (and the row no longer qualifies) or waits and then
+    inserts a fresh row for a file that store_upload has just rewritten.
+    """
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    async with SessionLocal() as db:
+        # Files without a row become ref_count 0 rows, so they go through the same locked path
+        known = set((await db.execute(select(StorageBlob.path))).scalars().all())
+        orphans = await run_io(_orphan_files, known, cutoff)
+        if orphans:
+            stale = datetime.now() - timedelta(seconds=grace_seconds + 1)
+            await db.execute(
+                insert(StorageBlob)
+                .values([{"path": path, "ref_count": 0, "created_at": stale, "updated_at": stale} for path in orphans])
+                .on_conflict_do_nothing(index_elements=[StorageBlob.path])
+            )
+            await db.commit()
+
+        while True:
+            candidates = (await db.execute(
+                select(StorageBlob.path)
+                .where(
+                    StorageBlob.ref_count <= 0,
+                    StorageBlob.updated_at < datetime.now() - timedelta(seconds=grace_seconds),
+                )
+                .limit(BLOB_GC_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not candidates:
+                break
+            for path in candidates:
+                if await run_io(_remove_if_stale, path, cutoff):
+                    await db.execute(delete(StorageBlob).where(StorageBlob.path == path))
+                    removed += 1
+                else:
+                    # Deduplicated just now: give its request a full grace period to retain it
+                    await db.execute(
+                        update(StorageBlob).where(StorageBlob.path == path).values(updated_at=datetime.now())
+                    )
+            await db.commit()
+    return removed
+
+
+if __name__ == "__main__":
+    # Offline cleanup job: python -m app.storage_utils
+    removed = asyncio.run(collect_garbage())
+    print(f"Removed {removed} unreferenced blobs")
@@ -0,0 +1,403 @@
+import asyncio
+import hashlib
+import struct
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set
+from sqlalchemy import and_, exists, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from app.cache_utils import TTLCache
+from app.database import SessionLocal
+from app.models import NGOProfile, DocumentScanResult, StorageBlob
+from app.config import (
+    CLAMD_HOST, CLAMD_PORT, CLAMD_POOL_SIZE, CLAMD_TIMEOUT_SECONDS,
+    VIRUS_SCAN_CACHE_TTL_SECONDS, VIRUS_SCAN_SWEEP_INTERVAL_SECONDS, MEDIA_ROOT,
+)
+
+SCAN_CHUNK_SIZE = 64 * 1024
+BLOB_SWEEP_BATCH_SIZE = 100
+UNSCANNED_BLOB_PREFIX = "blobs/"  # photos are re-encoded by us, so only raw uploads need clamd
+
+
+class ClamdError(Exception):
+    """clamd was unreachable or answered something we could not parse."""
+
+
+class ScanResult(NamedTuple):
+    clean: bool
+    signature: Optional[str] = None
+
+
+# Results by content sha256; expire so new signatures eventually get a look at old files
+scan_cache = TTLCache(max_size=10_000, ttl=VIRUS_SCAN_CACHE_TTL_SECONDS)
+
+
+def _parse_reply(reply: bytes) -> ScanResult:
+    # Session replies look like b"3: stream: OK" or b"3: stream: Eicar-Signature FOUND"
+    text = reply.rstrip(b"\0").decode(errors="replace")
+    _, _, status = text.partition(": ")
+    if status.endswith(" FOUND"):
+        return ScanResult(False, status.removeprefix("stream: ").removesuffix(" FOUND"))
+    if status == "stream: OK":
+        return ScanResult(True)
+    raise ClamdError(f"Unexpected clamd reply: {text}")
+
+
+# ----------------------------
+# clamd connections
+# ----------------------------
+class ClamdConnection:
+    """One clamd socket in IDSESSION mode, so it can run many INSTREAM scans."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float) -> "ClamdConnection":
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ClamdError(f"Cannot connect to clamd at {host}:{port}: {e}") from e
+        connection = cls(reader, writer, timeout)
+        await connection._send(b"zIDSESSION\0")
+        return connection
+
+    async def _send(self, data: bytes) -> None:
+        try:
+            self.writer.write(data)
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ClamdError(f"clamd write failed: {e}") from e
+
+    async def begin_stream(self) -> None:
+        await self._send(b"zINSTREAM\0")
+
+    async def send_chunk(self, chunk: bytes) -> None:
+        if chunk:
+            await self._send(struct.pack(">I", len(chunk)) + chunk)
+
+    async def end_stream(self) -> ScanResult:
+        await self._send(struct.pack(">I", 0))
+        try:
+            reply = await asyncio.wait_for(self.reader.readuntil(b"\0"), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise ClamdError(f"clamd read failed: {e}") from e
+        return _parse_reply(reply)
+
+    def close(self) -> None:
+        try:
+            self.writer.write(b"zEND\0")
+        except Exception:
+            pass
+        self.writer.close()
+
+
+class ClamdPool:
+    """
+    Keeps up to `size` clamd sessions open and hands them out one scan at a time.
+    Broken connections are dropped instead of being returned to the pool.
+    """
+
+    def __init__(self, host: str, port: int, size: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle: List[ClamdConnection] = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def acquire(self) -> ClamdConnection:
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                connection = self._idle.pop()
+                if not connection.writer.is_closing() and not connection.reader.at_eof():
+                    return connection
+                connection.close()
+            return await ClamdConnection.open(self.host, self.port, self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: ClamdConnection, reusable: bool = True) -> None:
+        if reusable:
+            self._idle.append(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+
+clamd_pool = ClamdPool(CLAMD_HOST, CLAMD_PORT, CLAMD_POOL_SIZE, CLAMD_TIMEOUT_SECONDS)
+
+
+# ----------------------------
+# Scanning
+# ----------------------------
+class StreamScan:
+    """
+    Scan an upload while it is being written: feed() each chunk as it is read and
+    finish() once the last one is written. clamd failures never fail the upload;
+    finish() then returns None, the blob keeps scan_status NULL and
+    DocumentScanQueue.scan_blobs() scans it later.
+    """
+
+    def __init__(self, pool: ClamdPool = clamd_pool):
+        self.pool = pool
+        self._connection: Optional[ClamdConnection] = None
+        self._failed = False
+
+    def _fail(self, error: Exception) -> None:
+        print(f"Virus scan unavailable, continuing unscanned: {error}")
+        self._failed = True
+        if self._connection is not None:
+            self.pool.release(self._connection, reusable=False)
+            self._connection = None
+
+    async def feed(self, chunk: bytes) -> None:
+        if self._failed:
+            return
+        try:
+            if self._connection is None:
+                self._connection = await self.pool.acquire()
+                await self._connection.begin_stream()
+            await self._connection.send_chunk(chunk)
+        except ClamdError as e:
+            self._fail(e)
+
+    async def finish(self, sha256: Optional[str] = None) -> Optional[ScanResult]:
+        if self._failed:
+            return None
+        try:
+            if self._connection is None:  # empty upload
+                self._connection = await self.pool.acquire()
+                await self._connection.begin_stream()
+            result = await self._connection.end_stream()
+        except ClamdError as e:
+            self._fail(e)
+            return None
+        self.pool.release(self._connection)
+        self._connection = None
+        if sha256:
+            scan_cache.set(sha256, result)
+        return result
+
+    def abort(self) -> None:
+        if self._connection is not None:
+            self.pool.release(self._connection, reusable=False)
+            self._connection = None
+        self._failed = True
+
+
+def _read_file(path: Path) -> List[bytes]:
+    with open(path, "rb") as f:
+        return list(iter(lambda: f.read(SCAN_CHUNK_SIZE), b""))
+
+
+async def scan_file(path: Path, pool: ClamdPool = clamd_pool) -> Optional[ScanResult]:
+    """
+    Scan a file already on disk, reusing a cached verdict for identical content.
+    Returns None if clamd is unavailable; raises OSError if the file cannot be read.
+    """
+    chunks = await asyncio.to_thread(_read_file, path)
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    cached = scan_cache.get(sha256)
+    if cached is not None:
+        return cached
+
+    scan = StreamScan(pool)
+    for chunk in chunks:
+        await scan.feed(chunk)
+    return await scan.finish(sha256)
+
+
+# ----------------------------
+# Background scanning of stored documents
+# ----------------------------
+NGO_DOCUMENT_FIELDS = {
+    "ngo_registration_doc_path": "ngo_registration_doc_virus_scanned",
+    "pan_doc_path": "pan_doc_virus_scanned",
+    "gst_doc_path": "gst_doc_virus_scanned",
+    "tan_doc_path": "tan_doc_virus_scanned",
+    "section8_doc_path": "section8_doc_virus_scanned",
+    "doc_12a_path": "doc_12a_virus_scanned",
+    "brand_image_path": "brand_image_virus_scanned",
+}
+
+
+def resolve_media_path(stored_path: str) -> Path:
+    path = Path(stored_path)
+    return path if path.is_absolute() else MEDIA_ROOT / path
+
+
+def _has_final_result(path_field: str):
+    """A DocumentScanResult already settles this document (same profile, field and file)."""
+    return exists().where(
+        DocumentScanResult.ngo_profile_id == NGOProfile.id,
+        DocumentScanResult.field == path_field,
+        DocumentScanResult.stored_path == getattr(NGOProfile, path_field),
+    )
+
+
+class DocumentScanQueue:
+    """
+    Scans NGOProfile documents in the background and sets their *_virus_scanned
+    flags once clamd reports them clean. Infected and missing files get a
+    DocumentScanResult instead, so they are not rescanned until the path changes.
+    A periodic sweep picks up anything uploaded outside this API; enqueue()
+    schedules a profile immediately. The sweep also scans every stored upload
+    blob that has no verdict yet (stored while clamd was down or scanning was off).
+    """
+
+    def __init__(self, workers: int, sweep_interval: float):
+        self.workers = workers
+        self.sweep_interval = sweep_interval
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._pending: Set[int] = set()
+        self._tasks = []
+
+    def enqueue(self, profile_id: int) -> None:
+        if profile_id not in self._pending:
+            self._pending.add(profile_id)
+            self._queue.put_nowait(profile_id)
+
+    async def sweep(self) -> None:
+        unscanned = or_(*(
+            and_(
+                getattr(NGOProfile, path).isnot(None),
+                getattr(NGOProfile, flag).isnot(True),
+                ~_has_final_result(path),
+            )
+            for path, flag in NGO_DOCUMENT_FIELDS.items()
+        ))
+        async with SessionLocal() as db:
+            profile_ids = (await db.execute(select(NGOProfile.id).where(unscanned))).scalars().all()
+        for profile_id in profile_ids:
+            self.enqueue(profile_id)
+
+    async def scan_blobs(self, batch_size: int = BLOB_SWEEP_BATCH_SIZE) -> int:
+        """Record a scan_status for unscanned upload blobs; stops early while clamd is down. Returns how many got one."""
+        recorded = 0
+        last_path = ""
+        while True:
+            async with SessionLocal() as db:
+                paths = (await db.execute(
+                    select(StorageBlob.path)
+                    .where(
+                        StorageBlob.scan_status.is_(None),
+                        StorageBlob.path.startswith(UNSCANNED_BLOB_PREFIX),
+                        StorageBlob.path > last_path,
+                    )
+                    .order_by(StorageBlob.path)
+                    .limit(batch_size)
+                )).scalars().all()
+            if not paths:
+                return recorded
+            for path in paths:
+                try:
+                    result = await scan_file(MEDIA_ROOT / path)
+                except FileNotFoundError:
+                    status = "missing"
+                else:
+                    if result is None:
+                        print(f"clamd unavailable; {path} stays unscanned until the next sweep")
+                        return recorded
+                    status = "clean" if result.clean else "infected"
+                    if not result.clean:
+                        print(f"Infected upload {path}: {result.signature}")
+                async with SessionLocal() as db:
+                    await db.execute(update(StorageBlob).where(StorageBlob.path == path).values(scan_status=status))
+                    await db.commit()
+                recorded += 1
+            last_path = paths[-1]
+
+    async def scan_profile(self, profile_id: int) -> None:
+        columns = [getattr(NGOProfile, name) for pair in NGO_DOCUMENT_FIELDS.items() for name in pair]
+        async with SessionLocal() as db:
+            row = (await db.execute(select(*columns).where(NGOProfile.id == profile_id))).first()
+            if row is None:
+                return
+            settled = set((await db.execute(
+                select(DocumentScanResult.field, DocumentScanResult.stored_path)
+                .where(DocumentScanResult.ngo_profile_id == profile_id)
+            )).all())
+
+        # Scan without holding a database connection
+        scanned: Dict[str, bool] = {}
+        final_results = []
+        for path_field, flag_field in NGO_DOCUMENT_FIELDS.items():
+            stored_path = getattr(row, path_field)
+            if not stored_path or getattr(row, flag_field) or (path_field, stored_path) in settled:
+                continue
+            try:
+                result = await scan_file(resolve_media_path(stored_path))
+            except FileNotFoundError:
+                print(f"NGO profile {profile_id} {path_field} is missing on disk: {stored_path}")
+                final_results.append({"field": path_field, "stored_path": stored_path, "status": "missing"})
+                continue
+            except OSError as e:
+                print(f"Cannot read NGO profile {profile_id} {path_field}: {e}")
+                continue
+            if result is None:
+                print(f"clamd unavailable; NGO profile {profile_id} {path_field} stays unscanned until the next sweep")
+                continue
+            if result.clean:
+                scanned[flag_field] = True
+            else:
+                print(f"Infected document on NGO profile {profile_id} {path_field}: {result.signature}")
+                final_results.append({
+                    "field": path_field, "stored_path": stored_path, "status": "infected", "signature": result.signature,
+                })
+
+        if scanned or final_results:
+            async with SessionLocal() as db:
+                if scanned:
+                    await db.execute(update(NGOProfile).where(NGOProfile.id == profile_id).values(**scanned))
+                if final_results:
+                    await db.execute(
+                        insert(DocumentScanResult)
+                        .values([{"ngo_profile_id": profile_id, "signature": None, **values} for values in final_results])
+                        .on_conflict_do_nothing(constraint="uq_document_scan_result")
+                    )
+                await db.commit()
+
+    async def _worker(self) -> None:
+        while True:
+            profile_id = await self._queue.get()
+            try:
+                await self.scan_profile(profile_id)
+            except Exception as e:
+                print(f"Virus scan of NGO profile {profile_id} failed: {e}")
+            finally:
+                self._pending.discard(profile_id)
+                self._queue.task_done()
+
+    async def _sweeper(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+                await self.scan_blobs()
+            except Exception as e:
+                print(f"Virus scan sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+document_scan_queue = DocumentScanQueue(workers=CLAMD_POOL_SIZE, sweep_interval=VIRUS_SCAN_SWEEP_INTERVAL_SECONDS)
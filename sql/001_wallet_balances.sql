@@ -0,0 +1,18 @@
+-- Per-user wallet balance snapshot (app/Advance/wallet.py) and the index behind
+-- paginated wallet history. Safe to re-run; apply before deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/001_wallet_balances.sql
+--
+-- CONCURRENTLY avoids locking wallet_transactions, so do not run this file inside
+-- a transaction (no psql --single-transaction). Balances are seeded lazily on first use.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_wallet_transactions_user_created ON wallet_transactions (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS wallet_balances (
+    user_id INTEGER NOT NULL,
+    balance DECIMAL(12, 2) NOT NULL,
+    transaction_count INTEGER NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES registration_user (id) ON DELETE CASCADE
+);
@@ -0,0 +1,30 @@
+-- Materialized reward point totals and monthly rollups (app/points_utils.py) and
+-- the index they are seeded from. Safe to re-run; apply before deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/002_points_totals.sql
+--
+-- CONCURRENTLY avoids locking points_pointshistory, so do not run this file inside
+-- a transaction. Each user's ledger is seeded from their history on first use.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_points_pointshistory_user_timestamp ON points_pointshistory (user_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS points_userpointstotal (
+    user_id INTEGER NOT NULL,
+    total_points INTEGER NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES registration_user (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS points_userpointsrollup (
+    id SERIAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    action_type_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT uq_points_rollup UNIQUE (user_id, action_type_id, month),
+    FOREIGN KEY (user_id) REFERENCES registration_user (id) ON DELETE CASCADE,
+    FOREIGN KEY (action_type_id) REFERENCES points_pointsactiontype (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS ix_points_userpointsrollup_id ON points_userpointsrollup (id);
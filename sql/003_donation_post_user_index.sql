@@ -0,0 +1,8 @@
+-- Index behind the per-post, per-user donation count (app/donation/user_donation.py).
+-- Safe to re-run; apply before deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/003_donation_post_user_index.sql
+--
+-- CONCURRENTLY avoids locking donate_donation, so do not run this file inside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_donate_donation_post_user ON donate_donation (ngopost_id, user_id);
@@ -0,0 +1,18 @@
+-- Final virus-scan outcomes (infected / missing) for NGO profile documents
+-- (app/virus_scan.py). Safe to re-run; apply before deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/004_document_scan_results.sql
+
+CREATE TABLE IF NOT EXISTS storage_documentscanresult (
+    id SERIAL NOT NULL,
+    ngo_profile_id INTEGER NOT NULL,
+    field VARCHAR(64) NOT NULL,
+    stored_path VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    signature VARCHAR(255),
+    scanned_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT uq_document_scan_result UNIQUE (ngo_profile_id, field, stored_path),
+    FOREIGN KEY (ngo_profile_id) REFERENCES registration_ngoprofile (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS ix_storage_documentscanresult_id ON storage_documentscanresult (id);
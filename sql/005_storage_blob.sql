@@ -0,0 +1,14 @@
+-- Reference counts and scan verdicts for the content-addressed upload store
+-- (app/storage_utils.py). Safe to re-run; apply before deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/005_storage_blob.sql
+
+CREATE TABLE IF NOT EXISTS storage_blob (
+    path VARCHAR(255) NOT NULL,
+    ref_count INTEGER NOT NULL,
+    scan_status VARCHAR(20),
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (path)
+);
+ALTER TABLE storage_blob ADD COLUMN IF NOT EXISTS scan_status VARCHAR(20);
@@ -0,0 +1,21 @@
+-- Transactional email outbox (app/email_utils.py). Safe to re-run; apply before
+-- deploying that code:
+--
+--     psql "$DATABASE_URL" -f sql/006_email_outbox.sql
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    locked_until TIMESTAMP WITHOUT TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    sent_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_email_outbox_id ON email_outbox (id);
+CREATE INDEX IF NOT EXISTS ix_email_outbox_status_next_attempt ON email_outbox (status, next_attempt_at);
@@ -0,0 +1,13 @@
+-- Normalized phone column and case-insensitive email index on registration_user
+-- (app/contact_utils.py). Safe to re-run; apply before deploying that code, then
+-- backfill the column:
+--
+--     psql "$DATABASE_URL" -f sql/007_user_contacts.sql
+--     python -m app.contact_utils
+--
+-- CONCURRENTLY avoids locking registration_user, so do not run this file inside a
+-- transaction. Until the backfill has run, phone lookups fall back to phone_number.
+
+ALTER TABLE registration_user ADD COLUMN IF NOT EXISTS phone_e164 VARCHAR(20);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_registration_user_phone_e164 ON registration_user (phone_e164);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_registration_user_email_lower ON registration_user (lower(email));
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# app.config reads these at import time; give the test run harmless defaults
+os.environ.setdefault("AUTHORIZATION_KEY", "test-key")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("MONGO_DATABASE_HOST", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DATABASE_NAME", "test")
+os.environ.setdefault("SMTP_HOST", "127.0.0.1")
+os.environ.setdefault("SMTP_PORT", "2525")
+os.environ.setdefault("SMTP_FROM", "noreply@example.com")
+os.environ.setdefault("EMAIL_USE_TLS", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,58 @@
+import pytest
+
+from app.contact_utils import Contact, classify_contact, legacy_phone_forms, normalize_phone
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("9876543210", "+919876543210"),
+    ("09876543210", "+919876543210"),
+    ("919876543210", "+919876543210"),
+    ("+919876543210", "+919876543210"),
+    ("00919876543210", "+919876543210"),
+    ("+91 98765-43210", "+919876543210"),
+    ("(987) 654.3210", "+919876543210"),
+    ("+1 415 555 0100", "+14155550100"),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+@pytest.mark.parametrize("raw", [
+    "",
+    "12345",
+    "98765432",
+    "987654321012",
+    "+1234567",
+    "98765x43210",
+    "+91+9876543210",
+    "0009876543210",
+])
+def test_normalize_phone_rejects_invalid(raw):
+    assert normalize_phone(raw) is None
+
+
+def test_normalize_phone_uses_given_country_code():
+    assert normalize_phone("4155550100", country_code="+1") == "+14155550100"
+    assert normalize_phone("14155550100", country_code="1") == "+14155550100"
+    assert normalize_phone("+919876543210", country_code="+1") == "+919876543210"
+
+
+def test_classify_contact_email_is_lowercased():
+    assert classify_contact("  User.Name+tag@Example.COM ") == Contact("email", "user.name+tag@example.com")
+    assert classify_contact("user@example.com").is_email
+
+
+def test_classify_contact_phone():
+    contact = classify_contact(" 098765 43210 ")
+    assert contact == Contact("phone", "+919876543210")
+    assert not contact.is_email
+
+
+@pytest.mark.parametrize("raw", ["", "   ", "user@", "@example.com", "user@example", "not a contact", "12345"])
+def test_classify_contact_rejects_invalid(raw):
+    assert classify_contact(raw) is None
+
+
+def test_legacy_phone_forms():
+    assert legacy_phone_forms("+919876543210") == ["+919876543210", "919876543210", "9876543210", "09876543210"]
+    assert legacy_phone_forms("+14155550100") == ["+14155550100", "14155550100"]
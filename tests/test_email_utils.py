@@ -0,0 +1,99 @@
+import asyncio
+
+from app import email_utils
+from app.email_utils import MailQueue
+
+
+class FakeSMTPServer:
+    """Minimal SMTP server that counts sessions and messages; can hang up after `drop_after` messages."""
+
+    def __init__(self, drop_after=None):
+        self.drop_after = drop_after
+        self.connections = 0
+        self.messages = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        served = 0
+        in_data = False
+        writer.write(b"220 fake ESMTP\r\n")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    self.messages += 1
+                    served += 1
+                    writer.write(b"250 OK queued\r\n")
+                    await writer.drain()
+                    if self.drop_after and served >= self.drop_after:
+                        break
+                continue
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                writer.write(b"250-fake\r\n250 8BITMIME\r\n")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                writer.write(b"250 OK\r\n")
+            elif command == "DATA":
+                in_data = True
+                writer.write(b"354 go ahead\r\n")
+            elif command == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"500 unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+
+async def send_all(monkeypatch, server, count, workers=1):
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    monkeypatch.setattr(email_utils, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(email_utils, "SMTP_PORT", listener.sockets[0].getsockname()[1])
+    monkeypatch.setattr(email_utils, "RECONNECT_BACKOFF_SECONDS", 0.01)
+    queue = MailQueue(max_size=count, workers=workers, batch_size=10, idle_timeout=5)
+    queue.start()
+    try:
+        results = await asyncio.gather(*[queue.send(f"user{i}@example.com", "Hello", "Body") for i in range(count)])
+        return queue, results
+    finally:
+        await queue.stop()
+        listener.close()
+        await listener.wait_closed()
+
+
+def test_enqueue_drops_when_full():
+    async def run():
+        queue = MailQueue(max_size=2, workers=1, batch_size=10, idle_timeout=5)  # not started, so nothing drains
+        accepted = [queue.enqueue("user@example.com", "Hello", "Body") for _ in range(3)]
+        return queue, accepted
+
+    queue, accepted = asyncio.run(run())
+    assert accepted == [True, True, False]
+    assert queue.depth == 2
+    assert queue.stats.dropped == 1
+    assert "email_dropped_total 1" in queue.render_prometheus()
+
+
+def test_connection_is_reused(monkeypatch):
+    server = FakeSMTPServer()
+    queue, results = asyncio.run(send_all(monkeypatch, server, 20))
+    assert all(results)
+    assert server.messages == 20
+    assert server.connections == 1
+    assert queue.stats.connects == 1
+    assert queue.stats.sent == 20
+
+
+def test_reconnects_after_server_drops(monkeypatch):
+    server = FakeSMTPServer(drop_after=3)
+    queue, results = asyncio.run(send_all(monkeypatch, server, 10))
+    assert all(results)
+    assert server.messages == 10
+    assert server.connections == 4
+    assert queue.stats.connects == 4
+    assert queue.stats.failed == 0
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from app import otp_utils
+from app.otp_utils import MemoryKVStore, OTPRateLimited, OTPService
+
+
+class FakeClock:
+    """Stands in for the `time` module inside otp_utils so expiry can be stepped."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(otp_utils, "time", fake)
+    return fake
+
+
+def make_service(**overrides):
+    settings = dict(ttl=300, max_attempts=3, contact_limit=2, ip_limit=3, window=600, length=6)
+    settings.update(overrides)
+    return OTPService(MemoryKVStore(), **settings)
+
+
+def wrong(code):
+    return f"{(int(code) + 1) % 10 ** len(code):0{len(code)}d}"
+
+
+def test_code_is_single_use(clock):
+    async def run():
+        service = make_service()
+        code = await service.issue("register", "User@Example.com")
+        assert len(code) == 6 and code.isdigit()
+        assert await service.verify("register", "user@example.com ", code)
+        assert not await service.verify("register", "user@example.com", code)
+    asyncio.run(run())
+
+
+def test_code_is_scoped_to_purpose_and_contact(clock):
+    async def run():
+        service = make_service()
+        code = await service.issue("register", "a@example.com")
+        assert not await service.verify("reset", "a@example.com", code)
+        assert not await service.verify("register", "b@example.com", code)
+        assert await service.verify("register", "a@example.com", code)
+    asyncio.run(run())
+
+
+def test_reissue_replaces_earlier_code(clock):
+    async def run():
+        service = make_service()
+        first = await service.issue("register", "a@example.com")
+        second = await service.issue("register", "a@example.com")
+        if first != second:
+            assert not await service.verify("register", "a@example.com", first)
+        assert await service.verify("register", "a@example.com", second)
+    asyncio.run(run())
+
+
+def test_code_expires_after_ttl(clock):
+    async def run():
+        service = make_service(ttl=60)
+        code = await service.issue("register", "a@example.com")
+        token = await service.bind("register", "a@example.com")
+        clock.now += 59
+        assert await service.bound_contact("register", token) == "a@example.com"
+        clock.now += 1
+        assert await service.bound_contact("register", token) is None
+        assert not await service.verify("register", "a@example.com", code)
+    asyncio.run(run())
+
+
+def test_code_is_burnt_after_max_attempts(clock):
+    async def run():
+        service = make_service(max_attempts=3)
+        code = await service.issue("register", "a@example.com")
+        for _ in range(3):
+            assert not await service.verify("register", "a@example.com", wrong(code))
+        # the right code no longer works once the attempts are used up
+        assert not await service.verify("register", "a@example.com", code)
+        # and a fresh code starts with a clean attempt counter
+        code = await service.issue("register", "a@example.com")
+        for _ in range(2):
+            assert not await service.verify("register", "a@example.com", wrong(code))
+        assert await service.verify("register", "a@example.com", code)
+    asyncio.run(run())
+
+
+def test_issue_is_rate_limited_per_contact(clock):
+    async def run():
+        service = make_service(contact_limit=2, window=600)
+        await service.issue("register", "a@example.com")
+        clock.now += 100
+        await service.issue("register", "A@example.com")
+        with pytest.raises(OTPRateLimited) as excinfo:
+            await service.issue("register", "a@example.com")
+        assert excinfo.value.retry_after == 500
+        # other contacts and purposes have their own budget
+        await service.issue("register", "b@example.com")
+        await service.issue("reset", "a@example.com")
+        clock.now += 500
+        await service.issue("register", "a@example.com")
+    asyncio.run(run())
+
+
+def test_issue_is_rate_limited_per_ip(clock):
+    async def run():
+        service = make_service(contact_limit=10, ip_limit=3)
+        for n in range(3):
+            await service.issue("register", f"user{n}@example.com", client_ip="203.0.113.7")
+        with pytest.raises(OTPRateLimited):
+            await service.issue("register", "user3@example.com", client_ip="203.0.113.7")
+        await service.issue("register", "user3@example.com", client_ip="203.0.113.8")
+    asyncio.run(run())
+
+
+def test_memory_store_evicts_oldest_key_when_full(clock):
+    async def run():
+        store = MemoryKVStore(max_keys=2)
+        await store.set("a", "1", ttl=60)
+        await store.set("b", "2", ttl=60)
+        await store.set("c", "3", ttl=60)
+        assert await store.get("a") is None
+        assert await store.get("b") == "2" and await store.get("c") == "3"
+    asyncio.run(run())
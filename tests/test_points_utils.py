@@ -0,0 +1,132 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from app.database import SessionLocal, engine
+from app.models import RewardHistory, UserPointsRollup, UserPointsTotal
+from app.points_utils import BadgeIndex, get_filtered_points, month_start, next_month
+
+USER_ID = 1
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+# (action_type_id, points, timestamp): rows right on and around month boundaries
+HISTORY = [
+    (1, 1, utc(2023, 12, 31, 23, 59, 59)),
+    (1, 2, utc(2024, 1, 1)),
+    (2, 4, utc(2024, 1, 15, 12)),
+    (1, 8, utc(2024, 1, 31, 23, 59, 59)),
+    (2, 16, utc(2024, 2, 1)),
+    (1, 32, utc(2024, 2, 29, 18)),
+    (1, 64, utc(2024, 3, 1, 0, 0, 1)),
+    (2, 128, utc(2024, 3, 31, 23)),
+]
+
+
+async def reset_tables():
+    async with engine.begin() as conn:
+        for table in (RewardHistory.__table__, UserPointsTotal.__table__, UserPointsRollup.__table__):
+            await conn.run_sync(table.drop, checkfirst=True)
+            await conn.run_sync(table.create)
+
+
+async def load_history(with_ledger: bool):
+    """Write HISTORY plus the ledger rows record_reward would have kept for it."""
+    async with SessionLocal() as db:
+        rollups = {}
+        for action_type_id, points, timestamp in HISTORY:
+            db.add(RewardHistory(user_id=USER_ID, action_type_id=action_type_id, points=points, timestamp=timestamp))
+            key = (action_type_id, month_start(timestamp))
+            rollups[key] = rollups.get(key, 0) + points
+        if with_ledger:
+            db.add(UserPointsTotal(user_id=USER_ID, total_points=sum(p for _, p, _ in HISTORY)))
+            for (action_type_id, month), points in rollups.items():
+                db.add(UserPointsRollup(user_id=USER_ID, action_type_id=action_type_id, month=month, points=points))
+        await db.commit()
+
+
+def expected(action_type_id=None, start_date=None, end_date=None):
+    return sum(
+        points for action, points, timestamp in HISTORY
+        if (action_type_id is None or action == action_type_id)
+        and (start_date is None or timestamp >= start_date)
+        and (end_date is None or timestamp <= end_date)
+    )
+
+
+def filtered(**filters):
+    async def run():
+        async with SessionLocal() as db:
+            return await get_filtered_points(db, USER_ID, **filters)
+    return asyncio.run(run())
+
+
+@pytest.fixture(params=[True, False], ids=["ledger", "no-ledger"])
+def history(request):
+    asyncio.run(reset_tables())
+    asyncio.run(load_history(with_ledger=request.param))
+
+
+RANGES = [
+    (None, None),
+    (utc(2024, 1, 1), None),
+    (None, utc(2024, 2, 1)),
+    (utc(2024, 1, 1), utc(2024, 2, 1)),
+    (utc(2024, 1, 1), utc(2024, 1, 31, 23, 59, 59)),
+    (utc(2023, 12, 31, 23, 59, 59), utc(2024, 3, 1)),
+    (utc(2024, 1, 1, 0, 0, 1), utc(2024, 3, 1, 0, 0, 1)),
+    (utc(2024, 1, 15), utc(2024, 3, 15)),
+    (utc(2024, 1, 15), utc(2024, 1, 31)),
+    (utc(2024, 2, 1), utc(2024, 2, 29, 23, 59, 59)),
+    (utc(2024, 2, 10), utc(2024, 2, 20)),
+    (utc(2024, 3, 1), utc(2024, 2, 1)),
+]
+
+
+@pytest.mark.parametrize("start_date, end_date", RANGES)
+@pytest.mark.parametrize("action_type_id", [None, 1, 2])
+def test_filtered_points_match_raw_history(history, action_type_id, start_date, end_date):
+    assert filtered(action_type_id=action_type_id, start_date=start_date, end_date=end_date) == \
+        expected(action_type_id, start_date, end_date)
+
+
+def test_months_are_utc_calendar_months():
+    # 03:00 on 1 Feb in India is still 31 Jan in UTC
+    assert month_start(datetime(2024, 2, 1, 3, tzinfo=IST)) == date(2024, 1, 1)
+    assert month_start(datetime(2024, 2, 1, 6, tzinfo=IST)) == date(2024, 2, 1)
+    assert next_month(date(2023, 12, 1)) == date(2024, 1, 1)
+    assert next_month(date(2024, 11, 1)) == date(2024, 12, 1)
+
+
+BADGES = [
+    {"name": "Gold", "min_points": 500, "max_points": None},
+    {"name": "Bronze", "min_points": 0, "max_points": 99},
+    {"name": "Silver", "min_points": 200, "max_points": 499},
+    {"name": "Unranked", "min_points": None, "max_points": None},
+]
+
+
+@pytest.mark.parametrize("points, current, upcoming", [
+    (-5, None, "Bronze"),
+    (0, "Bronze", "Silver"),
+    (99, "Bronze", "Silver"),
+    (100, None, "Silver"),
+    (199, None, "Silver"),
+    (200, "Silver", "Gold"),
+    (499, "Silver", "Gold"),
+    (500, "Gold", None),
+    (10 ** 6, "Gold", None),
+])
+def test_badge_index_resolves_ranges_and_gaps(points, current, upcoming):
+    found, following = BadgeIndex(BADGES).resolve(points)
+    assert (found and found["name"]) == current
+    assert (following and following["name"]) == upcoming
+
+
+def test_badge_index_without_badges():
+    assert BadgeIndex([]).resolve(10) == (None, None)
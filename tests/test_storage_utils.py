@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+
+import pytest
+from sqlalchemy import select
+
+import app.storage_utils as storage
+from app.database import SessionLocal, engine
+from app.models import StorageBlob
+
+
+class FakeUpload:
+    """Just enough of UploadFile for store_upload."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.size = len(data)
+        self.position = 0
+
+    async def seek(self, position):
+        self.position = position
+
+    async def read(self, size):
+        chunk = self.data[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+@pytest.fixture
+def media_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "MEDIA_ROOT", tmp_path)
+    monkeypatch.setattr(storage, "VIRUS_SCAN_ENABLED", False)
+
+    async def reset_table():
+        async with engine.begin() as conn:
+            await conn.run_sync(StorageBlob.__table__.drop, checkfirst=True)
+            await conn.run_sync(StorageBlob.__table__.create)
+
+    asyncio.run(reset_table())
+    return tmp_path
+
+
+def age(root, seconds):
+    then = time.time() - seconds
+    for file in root.rglob("*"):
+        if file.is_file():
+            os.utime(file, (then, then))
+
+
+def test_same_content_with_different_extensions_is_stored_once(media_root):
+    jpeg = b"\xff\xd8\xff\xe0 same photo"
+    first = asyncio.run(storage.store_upload(FakeUpload(jpeg), ".JPEG"))
+    second = asyncio.run(storage.store_upload(FakeUpload(jpeg), ".jpg"))
+    assert first.path == second.path
+    assert first.path.endswith(".jpg")
+    assert first.created and not second.created
+
+
+def test_unknown_formats_keep_their_declared_extension():
+    assert storage.detect_extension(b"plain text", ".TXT") == ".txt"
+    assert storage.detect_extension(b"%PDF-1.7", ".png") == ".pdf"
+
+
+def test_garbage_collection_spares_blobs_deduplicated_within_grace(media_root):
+    stale = asyncio.run(storage.store_upload(FakeUpload(b"nobody wants this"), ".txt"))
+    reused = asyncio.run(storage.store_upload(FakeUpload(b"uploaded again"), ".txt"))
+    age(media_root, storage.BLOB_GC_GRACE_SECONDS * 2)
+
+    # A new request deduplicates onto the old file but has not retained it yet
+    again = asyncio.run(storage.store_upload(FakeUpload(b"uploaded again"), ".txt"))
+    assert again.path == reused.path and not again.created
+
+    assert asyncio.run(storage.collect_garbage()) == 1
+    assert not (media_root / stale.path).exists()
+    assert (media_root / reused.path).exists()
+
+
+def test_garbage_collection_keeps_referenced_blobs(media_root):
+    blob = asyncio.run(storage.store_upload(FakeUpload(b"kept"), ".txt"))
+
+    async def retain():
+        async with SessionLocal() as db:
+            await storage.retain_blob(db, blob.path)
+            await db.commit()
+            return (await db.execute(select(StorageBlob.ref_count))).scalar()
+
+    assert asyncio.run(retain()) == 1
+    age(media_root, storage.BLOB_GC_GRACE_SECONDS * 2)
+    assert asyncio.run(storage.collect_garbage()) == 0
+    assert (media_root / blob.path).exists()
+
+
+def test_blob_key_accepts_blob_store_locations_only():
+    photo = "photos/ab/cd/abcd.jpg"
+    assert storage.blob_key(photo) == photo
+    assert storage.blob_key(f"/media/{photo}") == photo
+    assert storage.blob_key(f"{storage.MEDIA_ROOT.as_posix()}/blobs/ab/cd/abcd.pdf") == "blobs/ab/cd/abcd.pdf"
+    # Legacy uploads merely contain a namespace name
+    assert storage.blob_key("/static/profile_photos/user_1_me.jpg") is None
+    assert storage.blob_key("app/static/profile_photos/user_1_me.jpg") is None
+    assert storage.blob_key(None) is None
+
+
+def test_legacy_profile_photo_has_no_thumbnails():
+    from app.file_utils import photo_thumbnails
+
+    assert photo_thumbnails("/static/profile_photos/user_1_me.jpg") == {}
+    assert photo_thumbnails("/media/photos/ab/cd/abcd.jpg")["64"] == "/media/photos/ab/cd/abcd_64.jpg"
+
+
+def scanned_with(monkeypatch, verdict):
+    """Turn scanning on with scan_file answering `verdict`; returns the list of scanned paths."""
+    scanned = []
+
+    async def fake_scan_file(path):
+        scanned.append(path)
+        return verdict
+
+    monkeypatch.setattr(storage, "VIRUS_SCAN_ENABLED", True)
+    monkeypatch.setattr(storage, "scan_file", fake_scan_file)
+    return scanned
+
+
+def scan_status(path):
+    async def query():
+        async with SessionLocal() as db:
+            return (await db.execute(select(StorageBlob.scan_status).where(StorageBlob.path == path))).scalar()
+    return asyncio.run(query())
+
+
+def test_unscanned_duplicate_is_scanned_before_reuse(media_root, monkeypatch):
+    # Stored while scanning was off, so nothing vouches for it
+    blob = asyncio.run(storage.store_upload(FakeUpload(b"%PDF-1.4 stored unscanned"), ".pdf"))
+    assert scan_status(blob.path) is None
+
+    scanned = scanned_with(monkeypatch, storage.ScanResult(True))
+    for _ in range(2):
+        again = asyncio.run(storage.store_upload(FakeUpload(b"%PDF-1.4 stored unscanned"), ".pdf"))
+        assert again.path == blob.path
+    assert len(scanned) == 1
+    assert scan_status(blob.path) == "clean"
+
+
+def test_infected_duplicate_is_rejected(media_root, monkeypatch):
+    blob = asyncio.run(storage.store_upload(FakeUpload(b"%PDF-1.4 bad"), ".pdf"))
+    scanned_with(monkeypatch, storage.ScanResult(False, "Eicar-Test-Signature"))
+    with pytest.raises(storage.InfectedUpload):
+        asyncio.run(storage.store_upload(FakeUpload(b"%PDF-1.4 bad"), ".pdf"))
+    assert scan_status(blob.path) == "infected"
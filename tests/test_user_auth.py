@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import get_db
+from app.main import app
+from app.otp_utils import otp_service
+
+AUTH = {"authorization-key": "test-key"}
+
+
+class NoDatabase:
+    """Registration must be refused before any query runs."""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"database used: {name}")
+
+
+@pytest.fixture
+def client():
+    app.dependency_overrides[get_db] = lambda: NoDatabase()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def issue_registration_code(contact):
+    async def issue():
+        return await otp_service.issue("register", contact), await otp_service.bind("register", contact)
+    return asyncio.run(issue())
+
+
+def registration(email, phone, otp, otp_token):
+    return {
+        "first_name": "Test", "last_name": "User",
+        "email": email, "phone_number": phone,
+        "otp": otp, "otp_token": otp_token,
+    }
+
+
+def test_phone_code_cannot_register_someone_elses_email_and_phone(client):
+    otp, token = issue_registration_code("+919876543210")
+    response = client.post("/auth/register", headers=AUTH, json=registration("victim@example.com", "9123456789", otp, token))
+    assert response.status_code == 401
+
+
+def test_token_for_one_contact_cannot_carry_a_code_for_the_other(client):
+    # The attacker asks for a code to the victim's email (and gets its token), then
+    # presents that token with the code sent to their own phone
+    _, email_token = issue_registration_code("victim@example.com")
+    phone_otp, _ = issue_registration_code("+919876543210")
+    response = client.post("/auth/register", headers=AUTH, json=registration("victim@example.com", "9876543210", phone_otp, email_token))
+    assert response.status_code == 401
+
+
+def test_unknown_token_is_refused(client):
+    otp, _ = issue_registration_code("victim@example.com")
+    response = client.post("/auth/register", headers=AUTH, json=registration("victim@example.com", "9876543210", otp, "forged"))
+    assert response.status_code == 401
@@ -0,0 +1,122 @@
+import asyncio
+import struct
+
+from sqlalchemy import select
+
+import app.virus_scan as virus_scan
+from app.database import SessionLocal, engine
+from app.models import StorageBlob
+from app.virus_scan import ClamdPool, ScanResult, scan_cache, scan_file
+
+EICAR = b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+
+
+async def fake_clamd(reader, writer):
+    """Minimal clamd: IDSESSION, then any number of INSTREAM scans until zEND."""
+    assert await reader.readuntil(b"\0") == b"zIDSESSION\0"
+    request_id = 0
+    while True:
+        try:
+            command = await reader.readuntil(b"\0")
+        except asyncio.IncompleteReadError:
+            break
+        if command == b"zEND\0":
+            break
+        assert command == b"zINSTREAM\0"
+        request_id += 1
+        data = b""
+        while True:
+            (length,) = struct.unpack(">I", await reader.readexactly(4))
+            if not length:
+                break
+            data += await reader.readexactly(length)
+        status = "Eicar-Test-Signature FOUND" if b"EICAR-STANDARD" in data else "OK"
+        writer.write(f"{request_id}: stream: {status}\0".encode())
+        await writer.drain()
+    writer.close()
+
+
+async def scan_with_server(path):
+    server = await asyncio.start_server(fake_clamd, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    pool = ClamdPool("127.0.0.1", port, size=2, timeout=5)
+    try:
+        return await scan_file(path, pool)
+    finally:
+        pool.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_clean_file(tmp_path):
+    scan_cache.clear()
+    path = tmp_path / "clean.pdf"
+    path.write_bytes(b"%PDF-1.4 harmless" * 10_000)
+    assert asyncio.run(scan_with_server(path)) == ScanResult(True)
+
+
+def test_infected_file(tmp_path):
+    scan_cache.clear()
+    path = tmp_path / "eicar.pdf"
+    path.write_bytes(EICAR)
+    assert asyncio.run(scan_with_server(path)) == ScanResult(False, "Eicar-Test-Signature")
+
+
+def test_verdict_is_cached_by_content(tmp_path):
+    scan_cache.clear()
+    first = tmp_path / "a.pdf"
+    first.write_bytes(EICAR)
+    asyncio.run(scan_with_server(first))
+    second = tmp_path / "b.pdf"
+    second.write_bytes(EICAR)
+    # No clamd listening: only the cache can answer
+    unreachable = ClamdPool("127.0.0.1", 1, size=1, timeout=1)
+    assert asyncio.run(scan_file(second, unreachable)) == ScanResult(False, "Eicar-Test-Signature")
+
+
+def test_unavailable_clamd_returns_none_and_logs(tmp_path, capsys):
+    scan_cache.clear()
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"anything")
+    unreachable = ClamdPool("127.0.0.1", 1, size=1, timeout=1)
+    assert asyncio.run(scan_file(path, unreachable)) is None
+    assert "Virus scan unavailable" in capsys.readouterr().out
+
+
+def test_sweep_scans_unscanned_blobs(tmp_path, monkeypatch):
+    scan_cache.clear()
+    files = {"blobs/aa/clean.pdf": b"%PDF-1.4 fine", "blobs/bb/bad.pdf": EICAR, "photos/cc/me.jpg": EICAR}
+    for path, data in files.items():
+        (tmp_path / path).parent.mkdir(parents=True)
+        (tmp_path / path).write_bytes(data)
+    rows = [*files, "blobs/dd/gone.pdf"]
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(StorageBlob.__table__.drop, checkfirst=True)
+            await conn.run_sync(StorageBlob.__table__.create)
+        async with SessionLocal() as db:
+            db.add_all(StorageBlob(path=path, ref_count=1) for path in rows)
+            await db.commit()
+
+        server = await asyncio.start_server(fake_clamd, "127.0.0.1", 0)
+        pool = ClamdPool("127.0.0.1", server.sockets[0].getsockname()[1], size=1, timeout=5)
+        monkeypatch.setattr(virus_scan, "MEDIA_ROOT", tmp_path)
+        monkeypatch.setattr(virus_scan, "scan_file", lambda path: scan_file(path, pool))
+        try:
+            recorded = await virus_scan.document_scan_queue.scan_blobs(batch_size=2)
+        finally:
+            pool.close()
+            server.close()
+            await server.wait_closed()
+        async with SessionLocal() as db:
+            return recorded, dict((await db.execute(select(StorageBlob.path, StorageBlob.scan_status))).all())
+
+    recorded, statuses = asyncio.run(run())
+    assert recorded == 3
+    assert statuses == {
+        "blobs/aa/clean.pdf": "clean",
+        "blobs/bb/bad.pdf": "infected",
+        "blobs/dd/gone.pdf": "missing",
+        "photos/cc/me.jpg": None,
+    }